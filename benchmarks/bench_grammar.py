@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""Benchmark of the dungeon generation phases
+
+Runs every grammar over a fixed seed corpus for a sweep of maxnodes values, timing each
+phase of Dungeon.generate and the headless rendering separately, and saves the results as JSON.
+
+    $ python -m benchmarks.bench_grammar --output before.json
+    $ python -m benchmarks.bench_grammar --output after.json
+    $ python -m benchmarks.bench_grammar --compare before.json after.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import math
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from utils.batch import GRAMMARS, get_grammar, parse_seeds
+from utils.render import render_dungeon
+
+PHASES = ("_dungeonstart", "_process", "_red_cleanup", "_reduce_graph")
+MAXNODES = (300, 1000, 3000, 10000, 30000, 100000)
+
+
+def timed_class(cls):
+    """Returns a subclass of the grammar that times the generation phases"""
+
+    def init(self, **dargs):
+        self.timings = {}
+        cls.__init__(self, **dargs)
+
+    def timed(name):
+        method = getattr(cls, name)
+
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.timings[name] = time.perf_counter() - start
+
+        return wrapper
+
+    attrs = {name: timed(name) for name in PHASES}
+    attrs["__init__"] = init
+    return type(f"Timed{cls.__name__}", (cls,), attrs)
+
+
+def render(dungeon):
+    """Renders the dungeon to an in-memory PNG and returns the elapsed time"""
+    start = time.perf_counter()
+    render_dungeon(dungeon, io.BytesIO(), "png")
+    return time.perf_counter() - start
+
+
+def percentile(values, pct):
+    """Nearest rank percentile"""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def summary(values):
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def run_case(grammar, maxnodes, maxiter, seeds, render_max):
+    """Benchmarks a grammar for a maxnodes value over the seeds"""
+    cls = timed_class(get_grammar(grammar))
+    phases = {name: [] for name in PHASES + ("render", "total")}
+    rooms = []
+    for seed in seeds:
+        start = time.perf_counter()
+        dungeon = cls(seed=seed, maxnodes=maxnodes, maxiter=maxiter)
+        phases["total"].append(time.perf_counter() - start)
+        for name in PHASES:
+            phases[name].append(dungeon.timings.get(name, 0.0))
+        rooms.append(dungeon._g.vcount())
+        if maxnodes <= render_max:
+            phases["render"].append(render(dungeon))
+
+    memory = []
+    for seed in seeds:
+        tracemalloc.start()
+        cls(seed=seed, maxnodes=maxnodes, maxiter=maxiter)
+        memory.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    elapsed = sum(phases["total"])
+    return {
+        "grammar": grammar,
+        "maxnodes": maxnodes,
+        "maxiter": maxiter,
+        "seeds": len(seeds),
+        "rooms": summary(rooms),
+        "latency": {name: summary(values) for name, values in phases.items() if values},
+        "throughput": {
+            "dungeons_per_s": len(seeds) / elapsed,
+            "rooms_per_s": sum(rooms) / elapsed,
+        },
+        "peak_memory": summary(memory),
+    }
+
+
+def run(grammars, maxnodes, seeds, maxiter_factor, render_max):
+    results = []
+    for grammar in grammars:
+        for nodes in maxnodes:
+            result = run_case(grammar, nodes, nodes * maxiter_factor, seeds, render_max)
+            results.append(result)
+            total = result["latency"]["total"]
+            print(
+                f"{grammar:8} {nodes:>7} rooms p50 {result['rooms']['p50']:>7} "
+                f"total p50 {total['p50'] * 1000:9.2f}ms p99 {total['p99'] * 1000:9.2f}ms "
+                f"{result['throughput']['rooms_per_s']:10.0f} rooms/s "
+                f"peak {result['peak_memory']['max'] / 2**20:8.2f}MiB",
+                file=sys.stderr,
+            )
+    meta = metadata(seeds=[seeds[0], seeds[-1]], maxiter_factor=maxiter_factor)
+    return {"meta": meta, "results": results}
+
+
+def metadata(**extra):
+    """Returns the machine and code details of a run, plus the extra ones"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        **extra,
+    }
+
+
+def compare(before, after):
+    """Prints the relative change of the p50 latencies and the throughput of two runs"""
+    results = {(res["grammar"], res["maxnodes"]): res for res in before["results"]}
+    print(f"{'grammar':8} {'maxnodes':>8} {'metric':14} {'before':>12} {'after':>12} {'change':>8}")
+    for res in after["results"]:
+        old = results.get((res["grammar"], res["maxnodes"]))
+        if old is None:
+            continue
+        rows = [
+            (name, old["latency"][name]["p50"], lat["p50"])
+            for name, lat in res["latency"].items()
+            if name in old["latency"]
+        ]
+        rows.append(("rooms/s", old["throughput"]["rooms_per_s"], res["throughput"]["rooms_per_s"]))
+        rows.append(("peak memory", old["peak_memory"]["max"], res["peak_memory"]["max"]))
+        for name, was, now in rows:
+            change = (now - was) / was * 100 if was else 0.0
+            print(
+                f"{res['grammar']:8} {res['maxnodes']:>8} {name:14} {was:12.6g} {now:12.6g} "
+                f"{change:+7.1f}%"
+            )
+
+
+def main(known_args):
+    if known_args.compare:
+        with open(known_args.compare[0]) as fd:
+            before = json.load(fd)
+        with open(known_args.compare[1]) as fd:
+            after = json.load(fd)
+        compare(before, after)
+        return
+    logging.disable(logging.CRITICAL)
+    results = run(
+        known_args.grammars.split(","),
+        [int(nodes) for nodes in known_args.maxnodes.split(",")],
+        list(parse_seeds(known_args.seeds)),
+        known_args.maxiter_factor,
+        known_args.render_max,
+    )
+    if known_args.output:
+        with open(known_args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--grammars", default=",".join(GRAMMARS), help="Comma separated grammar names"
+    )
+    parser.add_argument(
+        "--maxnodes",
+        default=",".join(str(nodes) for nodes in MAXNODES),
+        help="Comma separated maxnodes values",
+    )
+    parser.add_argument("--seeds", default="1-20", help="Seed corpus (e.g. 1-20)")
+    parser.add_argument(
+        "--maxiter-factor", default=1, type=int, help="maxiter as a multiple of maxnodes"
+    )
+    parser.add_argument(
+        "--render-max", default=3000, type=int, help="Largest maxnodes value to render"
+    )
+    parser.add_argument("--output", help="JSON file for the results (default: stdout)")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files"
+    )
+    known_args, other_args = parser.parse_known_args()
+
+    main(known_args)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Benchmark of the cold start of the CLI scripts
+
+Runs each command in a fresh interpreter and saves the wall time distribution as JSON. The
+bare interpreter start is measured too, so the import and generation cost can be told apart.
+
+    $ python -m benchmarks.bench_startup --output startup.json
+    $ python -m benchmarks.bench_startup --compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_grammar import metadata, summary
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "python": ["-c", "pass"],
+    "import igraph": ["-c", "import igraph"],
+    "post24 json": ["dungeon_generator_cli.py", "--seed", "1", "--output", "json"],
+    "post30 json": ["dungeon_generator_cli.py", "--post30", "--seed", "1", "--output", "json"],
+    "post30 dot": ["dungeon_generator_cli.py", "--post30", "--seed", "1", "--output", "dot"],
+    "cyber json": ["cyber_generator_cli.py", "--seed", "1", "--output", "json"],
+}
+
+
+def run(names, runs):
+    results = []
+    for name in names:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable] + COMMANDS[name],
+                cwd=ROOT,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            times.append(time.perf_counter() - start)
+        result = {"command": name, "runs": runs, "latency": summary(times)}
+        results.append(result)
+        print(
+            f"{name:14} p50 {result['latency']['p50'] * 1000:8.1f}ms "
+            f"p99 {result['latency']['p99'] * 1000:8.1f}ms",
+            file=sys.stderr,
+        )
+    return {"meta": metadata(runs=runs), "results": results}
+
+
+def compare(before, after):
+    """Prints the relative change of the p50 latencies of two runs"""
+    results = {res["command"]: res for res in before["results"]}
+    print(f"{'command':14} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for res in after["results"]:
+        old = results.get(res["command"])
+        if old is None:
+            continue
+        was = old["latency"]["p50"]
+        now = res["latency"]["p50"]
+        print(
+            f"{res['command']:14} {was * 1000:10.1f} {now * 1000:10.1f} "
+            f"{(now - was) / was * 100:+7.1f}%"
+        )
+
+
+def main(known_args):
+    if known_args.compare:
+        with open(known_args.compare[0]) as fd:
+            before = json.load(fd)
+        with open(known_args.compare[1]) as fd:
+            after = json.load(fd)
+        compare(before, after)
+        return
+    results = run(known_args.commands.split(","), known_args.runs)
+    if known_args.output:
+        with open(known_args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--commands", default=",".join(COMMANDS), help="Comma separated command names"
+    )
+    parser.add_argument("--runs", default=20, type=int, help="Runs of each command")
+    parser.add_argument("--output", help="JSON file for the results (default: stdout)")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files"
+    )
+    known_args, other_args = parser.parse_known_args()
+
+    main(known_args)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+
+from utils.batch import GRAMMARS, parse_seeds
+from utils.catalog import Catalog, write_catalog
+from utils.graph_utils import setup_logging
+from utils.seed_search import METRICS
+
+
+def main(known_args):
+    """Adds the dungeons of the seeds to the catalog and prints a JSON line with the seed and
+    metrics of each cataloged dungeon that holds the constraints"""
+    setup_logging(known_args.debug)
+    dungeon_args = {
+        'maxiter': known_args.maxiter,
+        'maxnodes': known_args.maxnodes,
+        'reduce': not known_args.no_reduce,
+        'budget': known_args.budget,
+    }
+    if known_args.add:
+        added = write_catalog(
+            known_args.database,
+            known_args.grammar,
+            parse_seeds(known_args.add),
+            jobs=known_args.jobs,
+            chunksize=known_args.chunksize,
+            **dungeon_args,
+        )
+        print(f"Added {added} dungeons to {known_args.database}", file=sys.stderr)
+    if not known_args.constraints:
+        return
+    with Catalog(known_args.database) as catalog:
+        try:
+            matches = catalog.query(
+                known_args.grammar, known_args.constraints, limit=known_args.limit, **dungeon_args
+            )
+        except ValueError as e:
+            sys.exit(str(e))
+    for match in matches:
+        print(json.dumps(match))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Catalogs the metrics of generated dungeons and searches them",
+        epilog=f"Constraints are <metric><op><value> or <metric>=<low>..<high>, like "
+        f"rooms.EXIT>=2 path>20 vertices=40..60. Metrics: {', '.join(METRICS)}",
+    )
+    parser.add_argument("database", help="SQLite database of the catalog")
+    parser.add_argument("constraints", nargs="*", help="Constraints to hold")
+    parser.add_argument(
+        "--grammar", default="post24", choices=list(GRAMMARS), help="Grammar of the dungeons"
+    )
+    parser.add_argument("--add", metavar="SEEDS", help="Seeds to generate and add (e.g. 1-100000)")
+    parser.add_argument("--limit", default=None, type=int, help="Maximum number of matches")
+    parser.add_argument(
+        "--maxnodes", default=300, type=int, help="Maximum number of nodes to include"
+    )
+    parser.add_argument(
+        "--maxiter", default=200, type=int, help="Maximum number of iterations to perform"
+    )
+    parser.add_argument(
+        "--no-reduce", action="store_true", help="Does not reduce n,e,p adjacent elements"
+    )
+    parser.add_argument(
+        "--budget",
+        action="store_true",
+        help="Takes the cheapest productions near maxnodes and maxiter to finish the rooms",
+    )
+    parser.add_argument("--jobs", default=None, type=int, help="Worker processes (default: CPUs)")
+    parser.add_argument("--chunksize", default=32, type=int, help="Seeds sent to a worker at once")
+    parser.add_argument("--debug", action="store_true", help="Debug information")
+    known_args, other_args = parser.parse_known_intermixed_args()
+
+    main(known_args)
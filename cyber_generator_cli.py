@@ -1,11 +1,10 @@
 #!/usr/bin/env python
 
 import argparse
-import logging
 
 from cyberpuzze import Cyber
-
-logging.getLogger().setLevel(logging.DEBUG)
+from utils.export import EXPORTERS
+from utils.graph_utils import setup_logging
 
 
 def main(known_args):
@@ -13,6 +12,7 @@ def main(known_args):
     :returns: TODO
 
     """
+    setup_logging(known_args.debug)
     cyber_args = {
         'seed': known_args.seed,
         'show_graph': known_args.show_graph,
@@ -21,7 +21,9 @@ def main(known_args):
         'maxnodes': known_args.maxnodes,
         'reduce': not known_args.no_reduce,
     }
-    Cyber(**cyber_args)
+    cyber = Cyber(**cyber_args)
+    if known_args.output:
+        print(EXPORTERS[known_args.output](cyber))
 
 
 if __name__ == "__main__":
@@ -39,6 +41,9 @@ if __name__ == "__main__":
         "--no-reduce", action="store_true", help="Does not reduce n,e,p adjacent elements"
     )
     parser.add_argument("--debug", action="store_true", help="Debug information")
+    parser.add_argument(
+        "--output", choices=sorted(EXPORTERS), help="Writes the dungeon to the standard output"
+    )
     known_args, other_args = parser.parse_known_args()
 
     main(known_args)
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+
+from utils.daemon import TIMEOUT, DungeonDaemon
+from utils.graph_utils import setup_logging
+
+
+def main(known_args):
+    """Runs the generation daemon until it gets SIGINT or SIGTERM"""
+    setup_logging(known_args.debug)
+    daemon = DungeonDaemon(
+        known_args.socket,
+        jobs=known_args.jobs,
+        max_pending=known_args.max_pending,
+        timeout=known_args.timeout,
+    )
+    asyncio.run(daemon.serve())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--socket", default="/tmp/dungeon_generator.sock", help="Path of the Unix socket"
+    )
+    parser.add_argument("--jobs", default=None, type=int, help="Worker processes (default: CPUs)")
+    parser.add_argument(
+        "--max-pending",
+        default=None,
+        type=int,
+        help="Generations queued or running at once (default: 4 per worker)",
+    )
+    parser.add_argument(
+        "--timeout", default=TIMEOUT, type=float, help="Default seconds to wait for a dungeon"
+    )
+    parser.add_argument("--debug", action="store_true", help="Debug information")
+    known_args, other_args = parser.parse_known_args()
+
+    main(known_args)
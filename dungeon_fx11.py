@@ -1,3 +1,4 @@
+from utils.grammar import Rule
 from utils.graph_utils import Dungeon
 
 from utils.color_utils import (
@@ -12,6 +13,24 @@ from utils.color_utils import (
 
 
 class D30(Dungeon):
+    GRAMMAR = (
+        Rule("E", "_generate_E", ((50, False), (50, True))),
+        Rule("GB", "_generate_GB"),
+        Rule("H", "_generate_H", ((50, False), (50, True))),
+        Rule("K", "_generate_K", ((50, True), (50, False))),
+        Rule(
+            "L",
+            "_generate_L",
+            ((10, "H"), (15, "K"), (15, "MS"), (10, "S"), (15, "LRL"), (35, "RLRL")),
+            cap=16,
+        ),
+        Rule("MS", "_generate_MS", ((50, False), (50, True))),
+        Rule("R", "_generate_R", ((20, "n"), (20, "t"), (20, "m"), (20, "p"), (20, "c"))),
+        Rule("S", "_generate_S", ((50, False), (50, True))),
+        Rule("SW", "_generate_SW", ((50, False), (50, True)), cap=6),
+        Rule("SWL", "_generate_SWL", ((50, False), (50, True)), cap=6),
+    )
+
     def _dungeonstart(self):
         """Generates the initial layout of the dungeon"""
         sv = self._g.vs[0]
@@ -19,69 +38,18 @@ class D30(Dungeon):
         self._insert_room_btw(sv, gv, "E")
         return
 
-    def _rv_processor(self, rv):
-        """Process the red vertex according to its type"""
-        lrooms = self._rooms.get("L") or 0
-        srooms = self._rooms.get("SW") or 0
-        wrooms = self._rooms.get("SWL") or 0
-
-        func = {
-            "E": self._generate_E,
-            "GB": self._generate_GB,
-            "H": self._generate_H,
-            "K": self._generate_K,
-            "MS": self._generate_MS,
-            "R": self._generate_R,
-            "S": self._generate_S,
-            "L": self._generate_L if lrooms  < 16 else None,
-            "SW": self._generate_SW if srooms < 6 else None,
-            "SWL": self._generate_SWL if wrooms < 6 else None,
-        }.get(rv["type"], None)
-
-        if func is None:
-            self._format_nv(rv, "n", color_green)
-            return None
-
-        return func(rv)
-
-    def _process(self):
-        """Main graph processor
-
-        Tries to substitute every red vertex with the correspondent sequence.
-
-        Finishes after 200 iterations or if the graph has 1 000 vertices
-        """
-        missing_gram = set()
-        while True:
-            self._niter += 1
-            # get all the red vertices
-            #  self.plot_dungeon(debug=True)
-            red_vertices = self._g.vs.select(color_eq=color_red, reviewed_eq=False)
-            if not red_vertices:
-                break
-            rv = red_vertices[0]
-            rv["reviewed"] = True
-            status = self._rv_processor(rv)
-            if status is None:
-                missing_gram.add(rv["type"])
-            if self._g.vcount() > self._maxnode or self._niter > self._maxiter:
-                break
-        if missing_gram:
-            self.logger.error(f"Missing grammar for {missing_gram}")
-        return
-
-    def _generate_E(self, rv):
+    def _generate_E(self, rv, exit):
         """Entrance
 
         Arguments
             rv int:  Reference vertex
+            exit bool:  Add a second entrance with an EXIT
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
-        roll = self.d100
-        if roll <= 50:
+        if not exit:
             fn = ln = self._insert_room_btw(voi, vdi, "L")
         else:
             fn = self._insert_room_btw(voi, vdi, "E")
@@ -107,11 +75,12 @@ class D30(Dungeon):
         self._remove_room(rv, fn)
         return
 
-    def _generate_H(self, rv):
+    def _generate_H(self, rv, secret):
         """Hook
 
         Arguments
             rv int:  Reference vertex
+            secret bool:  Hide the bonus goal behind a secret room
 
         """
         voi = self._g.neighbors(rv, "in")[0]
@@ -119,25 +88,24 @@ class D30(Dungeon):
 
         fn = self._insert_room_btw(voi, vdi, "R")
         ng = self._insert_room_end(fn, "GB")
-        roll = self.d100
-        if roll > 50:
+        if secret:
             self._insert_room_btw(fn, ng, "s", color=color_black)
         self._remove_room(rv, fn)
         return
 
-    def _generate_K(self, rv):
+    def _generate_K(self, rv, key):
         """Lock
 
         Arguments
             rv int:  Reference vertex
+            key bool:  Lock with a key, otherwise split in two locks
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
         fn = self._insert_room_btw(voi, vdi, "R")
-        roll = self.d100
-        if roll <= 50:
+        if key:
             ln = self._insert_room_btw(fn, vdi, "L")
             sl = self._insert_room_end(fn, "L")
 
@@ -154,56 +122,38 @@ class D30(Dungeon):
         self._remove_room(rv, fn, ln)
         return
 
-    def _generate_L(self, rv):
+    def _generate_L(self, rv, layout):
         """Layout
 
         Arguments
             rv int:  Reference vertex
+            layout str:  Room type or LRL/RLRL sequence that replaces the vertex
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
-        roll = self.d100
-        if roll <= 10:
-            fn = self._insert_room_btw(voi, vdi, "H")
-            ln = fn
-        elif roll <= 25:
-            fn = self._insert_room_btw(voi, vdi, "K")
-            ln = fn
-        elif roll <= 40:
-            fn = self._insert_room_btw(voi, vdi, "MS")
-            ln = fn
-        elif roll <= 50:
-            fn = self._insert_room_btw(voi, vdi, "S")
-            ln = fn
-        elif roll <= 65:
+        if layout == "LRL":
             fn = self._insert_room_btw(voi, vdi, "L")
             rn = self._insert_room_btw(fn, vdi, "R")
             ln = self._insert_room_btw(rn, vdi, "L")
-        elif roll <= 75:
-            fn = self._insert_room_btw(voi, vdi, "R")
-            rn = self._insert_room_btw(fn, vdi, "L")  # oneway entrance
-            ln = self._insert_room_btw(rn, vdi, "R")
-            self._insert_room_btw(fn, ln, "L")
-        elif roll <= 85:
+        elif layout == "RLRL":
             fn = self._insert_room_btw(voi, vdi, "R")
             rn = self._insert_room_btw(fn, vdi, "L")  # oneway entrance
             ln = self._insert_room_btw(rn, vdi, "R")
             self._insert_room_btw(fn, ln, "L")  # oneway return
         else:
-            fn = self._insert_room_btw(voi, vdi, "R")
-            rn = self._insert_room_btw(fn, vdi, "L")
-            ln = self._insert_room_btw(rn, vdi, "R")
-            self._insert_room_btw(fn, ln, "L")
+            fn = self._insert_room_btw(voi, vdi, layout)
+            ln = fn
         self._remove_room(rv, fn, ln)
         return
 
-    def _generate_MS(self, rv):
+    def _generate_MS(self, rv, lock):
         """Multi switch
 
         Arguments
             rv int:  Reference vertex
+            lock bool:  Add a switch lock leading to a bonus goal
 
         """
         voi = self._g.neighbors(rv, "in")[0]
@@ -214,66 +164,55 @@ class D30(Dungeon):
         switch = self._add_object_dungeon("switch", f"switch {nsws}")
         self._insert_room_end(fn, "SW", object=switch)
         ln = self._insert_room_btw(fn, vdi, f"Check {switch.name}", color=color_pink)
-        roll = self.d100
-        if roll > 50:
+        if lock:
             ns = self._insert_room_end(fn, "SWL", object=switch)
             self._insert_room_end(ns, "GB")
         self._remove_room(rv, fn, ln)
 
-    def _generate_R(self, rv):
+    def _generate_R(self, rv, type):
         """Room chooser
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the room
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
-        roll = self.d100
-        if roll <= 20:
-            type = "n"
-        elif roll <= 40:
-            type = "t"
-        elif roll <= 60:
-            type = "m"
-        elif roll <= 80:
-            type = "p"
-        else:
-            type = "c"
         fn = self._insert_room_btw(voi, vdi, type, color=color_green)
         self._remove_room(rv, fn)
 
-    def _generate_S(self, rv):
+    def _generate_S(self, rv, more):
         """Linear
 
         Arguments
             rv int:  Reference vertex
+            more bool:  Continue the sequence with another S
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
         fn = self._insert_room_btw(voi, vdi, "R")
-        roll = self.d100
-        if roll > 50:
+        if more:
             ln = self._insert_room_btw(fn, vdi, "S")
         else:
             ln = fn
         self._remove_room(rv, fn, ln)
 
-    def _generate_SW(self, rv):
+    def _generate_SW(self, rv, more):
         """Switch
 
         Arguments
             rv int:  Reference vertex
+            more bool:  Add another switch to the sequence
 
         """
         voi = self._g.neighbors(rv, "in")[0]
 
         switch = self._get_object_vertex(rv)
-        roll = self.d100
-        if roll <= 50:
+        if not more:
             fn = self._insert_room_end(voi, "L")
             self._insert_room_end(fn, f"{switch.name}", color=color_pink)
         else:
@@ -283,19 +222,19 @@ class D30(Dungeon):
             nl = self._insert_room_end(fn, "SW", object=switch)
         self._remove_room(rv, fn)
 
-    def _generate_SWL(self, rv):
+    def _generate_SWL(self, rv, more):
         """Switch Lock
 
         Arguments
             rv int:  Reference vertex
+            more bool:  Add another switch lock leading to a bonus goal
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
         switch = self._get_object_vertex(rv)
-        roll = self.d100
-        if roll <= 50:
+        if not more:
             fn = self._insert_room_btw(voi, vdi, "L")
             ns = self._insert_room_btw(fn, vdi, f"{switch.name}", color=color_pink)
             ln = self._insert_room_btw(ns, vdi, "L")
@@ -310,6 +249,35 @@ class D30(Dungeon):
 
 
 class D24(Dungeon):
+    GRAMMAR = (
+        Rule("C", "_generate_C", ((25, "H"), (25, "MO"), (25, "MM"), (25, "MS")), cap=6),
+        Rule(
+            "GB",
+            "_generate_GB",
+            (
+                (25, ("UI", "hp", "Heart piece")),
+                (25, ("MI", "ir", "Rupees")),
+                (25, ("MI", "ib", "Bombs")),
+                (25, ("MI", "ia", "Arrows")),
+            ),
+        ),
+        Rule("H", "_generate_H"),
+        Rule("MI", "_generate_MI", ((30, "C"), (70, "S"))),
+        Rule("ML", "_generate_ML", ((75, False), (25, True))),
+        Rule("MM", "_generate_MM"),
+        Rule("MM2", "_generate_MM2", ((50, False), (50, True))),
+        Rule("MO", "_generate_MO"),
+        Rule("MS", "_generate_MS"),
+        Rule("MS2", "_generate_MS2", ((75, False), (25, True))),
+        Rule("OL", "_generate_OL", ((30, "C"), (70, "S"))),
+        Rule("OM", "_generate_OM"),
+        Rule("OO", "_generate_OO"),
+        Rule("S", "_generate_S", ((90, "e"), (10, "S"))),
+        Rule("SW", "_generate_SW", ((30, "C"), (70, "S")), cap=3),
+        Rule("SWL", "_generate_SWL", ((30, "C"), (70, "S")), cap=3),
+        Rule("UI", "_generate_UI", ((30, "C"), (70, "S"))),
+    )
+
     def _dungeonstart(self):
         """Generates the initial layout of the dungeon"""
         sv = self._g.vs[0]
@@ -356,68 +324,6 @@ class D24(Dungeon):
             self._insert_room_btw(sv, nv_ui, "OL", object=key)
         return
 
-    def _rv_processor(self, rv):
-        """Process the red vertex according to its type"""
-        crooms = self._rooms.get("C") or 0
-        srooms = self._rooms.get("SW") or 0
-        wrooms = self._rooms.get("SWL") or 0
-
-        func = {
-            "C": self._generate_C if crooms < 6 else None,
-            "GB": self._generate_GB,
-            "H": self._generate_H,
-            "MI": self._generate_MI,
-            "ML": self._generate_ML,
-            "MM": self._generate_MM,
-            "MM2": self._generate_MM2,
-            "MO": self._generate_MO,
-            "MS": self._generate_MS,
-            "MS2": self._generate_MS2,
-            "OL": self._generate_OL,
-            "OM": self._generate_OM,
-            "OO": self._generate_OO,
-            "S": self._generate_S,
-            "SW": self._generate_SW if srooms < 3 else None,
-            "SWL": self._generate_SWL if wrooms < 3 else None,
-            "UI": self._generate_UI,
-        }.get(rv["type"], None)
-
-        if func is None:
-            self._format_nv(rv, "n", color_green)
-            return None
-
-        return func(rv)
-
-    def _process(self):
-        """Main graph processor
-
-        Tries to substitute every red vertex with the correspondent sequence.
-
-        The number of C sequences is reduced to a max of 5.
-
-        The number of SW and SWL sequences is reduced to a max of 2.
-
-        Finishes after 200 iterations or if the graph has 1 000 vertices
-        """
-        missing_gram = set()
-        while True:
-            self._niter += 1
-            # get all the red vertices
-            red_vertices = self._g.vs.select(color_eq=color_red, reviewed_eq=False)
-            if not red_vertices:
-                break
-            rv = red_vertices[0]
-            rv["reviewed"] = True
-            status = self._rv_processor(rv)
-            if status is None:
-                missing_gram.add(rv["type"])
-            # max num of iter
-            if self._g.vcount() > self._maxnode or self._niter > self._maxiter:
-                break
-        if missing_gram:
-            self.logger.error(f"Missing grammar for {missing_gram}")
-        return
-
     def _retrieve_bang(self, rv):
         """Tries to retrieve an external object for the vertex"""
         # retrieve !
@@ -430,51 +336,33 @@ class D24(Dungeon):
                 bang = self._get_dungeon_object_type("bang")
         return bang
 
-    def _generate_C(self, rv):
+    def _generate_C(self, rv, type):
         """Chain
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the sequence in the chain
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
-        roll = self.d100
-        if roll <= 25:
-            type = "H"
-        elif roll <= 50:
-            type = "MO"
-        elif roll <= 75:
-            type = "MM"
-        else:
-            type = "MS"
         fn = self._insert_room_btw(voi, vdi, type)
         self._remove_room(rv, fn)
         return
 
-    def _generate_GB(self, rv):
+    def _generate_GB(self, rv, bonus):
         """Bonus Goal Sequence
 
         Arguments
             rv int:  Reference vertex
+            bonus tuple:  Type of the sequence, type and name of the bonus object
 
         """
         voi = self._g.neighbors(rv, "in")[0]
 
-        roll = self.d100
-        if roll <= 25:
-            gbobj = self._add_object_dungeon("hp", "Heart piece")
-            type = "UI"
-        elif roll <= 50:
-            gbobj = self._add_object_dungeon("ir", "Rupees")
-            type = "MI"
-        elif roll <= 75:
-            gbobj = self._add_object_dungeon("ib", "Bombs")
-            type = "MI"
-        else:
-            gbobj = self._add_object_dungeon("ia", "Arrows")
-            type = "MI"
+        type, otype, oname = bonus
+        gbobj = self._add_object_dungeon(otype, oname)
         fn = self._insert_room_end(voi, type, object=gbobj)
         self._remove_room(rv, fn)
         return
@@ -494,11 +382,12 @@ class D24(Dungeon):
         self._remove_room(rv, fn, fn)
         return
 
-    def _generate_OL(self, rv):
+    def _generate_OL(self, rv, type):
         """One lock sequence
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the sequence before the lock
 
         """
         voi = self._g.neighbors(rv, "in")[0]
@@ -506,11 +395,6 @@ class D24(Dungeon):
 
         olobj = self._get_object_vertex(rv)
 
-        roll = self.d100
-        if roll <= 30:
-            type = "C"
-        else:
-            type = "S"
         fn = self._insert_room_btw(voi, vdi, type)
         nv_k = self._insert_room_btw(fn, vdi, f"Use {olobj.name}", color=color_blue)
         ln = self._insert_room_btw(nv_k, vdi, "n", color=color_green)
@@ -555,20 +439,16 @@ class D24(Dungeon):
         self._remove_room(rv, fn, ln)
         return
 
-    def _generate_MI(self, rv):
+    def _generate_MI(self, rv, type):
         """Many items
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the sequence to the item
 
         """
         voi = self._g.neighbors(rv, "in")[0]
 
-        roll = self.d100
-        if roll <= 30:
-            type = "C"
-        else:
-            type = "S"
         fn = self._insert_room_end(voi, type)
 
         miobject = self._get_object_vertex(rv)
@@ -577,18 +457,18 @@ class D24(Dungeon):
         self._remove_room(rv, fn)
         return
 
-    def _generate_ML(self, rv):
+    def _generate_ML(self, rv, more):
         """Many lock sequence
 
         Arguments
             rv int:  Reference vertex
+            more bool:  Add another many lock sequence
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
-        roll = self.d100
-        if roll <= 75:
+        if not more:
             type = "OL"
             color = color_red
             mlobject = self._get_object_vertex(rv)
@@ -597,7 +477,7 @@ class D24(Dungeon):
             color = color_green
             mlobject = None
         fn = ln = self._insert_room_btw(voi, vdi, type, object=mlobject, color=color)
-        if roll > 75:
+        if more:
             mlobject = self._get_object_vertex(rv)
             nv_ml = self._insert_room_end(fn, "ML", object=mlobject)
             self._insert_room_end(nv_ml, "GB")
@@ -634,11 +514,12 @@ class D24(Dungeon):
         self._remove_room(rv, fn, ln)
         return
 
-    def _generate_MM2(self, rv):
+    def _generate_MM2(self, rv, more):
         """Switch lock chain II
 
         Arguments
             rv int:  Reference vertex
+            more bool:  Add another switch lock chain leading to a bonus goal
 
         """
         voi = self._g.neighbors(rv, "in")[0]
@@ -659,8 +540,7 @@ class D24(Dungeon):
         ln = self._insert_room_btw(fn, vdi, "SWL", object=obj)
         self._g.add_edges([(nv_bang, ln)])
 
-        roll = self.d100
-        if roll > 50:
+        if more:
             nv_mm = self._insert_room_end(nv_bang, "MM2", object=obj)
             self._insert_room_end(nv_mm, "GB")
 
@@ -707,11 +587,12 @@ class D24(Dungeon):
         self._remove_room(rv, fn, ln)
         return
 
-    def _generate_MS2(self, rv):
+    def _generate_MS2(self, rv, more):
         """Multi switch sequence II
 
         Arguments
             rv int:  Reference vertex
+            more bool:  Add another multi switch sequence
 
         """
         voi = self._g.neighbors(rv, "in")[0]
@@ -721,56 +602,40 @@ class D24(Dungeon):
         nv_sw = self._insert_room_end(fn, "SW")
         nv_and = self._insert_room_end(nv_sw, "and", color=color_pink)
 
-        roll = self.d100
-        if roll > 75:
+        if more:
             self._insert_room_btw(fn, nv_and, "MS2")
 
         self._remove_room(rv, fn)
         return
 
-    def _generate_S(self, rv):
+    def _generate_S(self, rv, type):
         """Linear sequence
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the room, S continues the sequence
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
-        roll = self.d100
-        if roll <= 30:
-            type = "n"
-            color = color_green
-        if roll <= 60:
-            type = "p"
-            color = color_green
-        if roll <= 90:
-            type = "e"
-            color = color_green
-        else:
-            type = "S"
-            color = color_red
+        color = color_red if type == "S" else color_green
         fn = ln = self._insert_room_btw(voi, vdi, type, color=color)
-        if roll > 90:
+        if type == "S":
             ln = self._insert_room_btw(fn, vdi, "S")
         self._remove_room(rv, fn, ln)
         return
 
-    def _generate_SW(self, rv):
+    def _generate_SW(self, rv, type):
         """Switch sequence
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the sequence to the switch
 
         """
         voi = self._g.neighbors(rv, "in")[0]
 
-        roll = self.d100
-        if roll <= 30:
-            type = "C"
-        else:
-            type = "S"
         fn = self._insert_room_end(voi, type)
         obj = self._get_object_vertex(rv)
         if obj is None:
@@ -780,21 +645,17 @@ class D24(Dungeon):
         self._remove_room(rv, fn)
         return
 
-    def _generate_SWL(self, rv):
+    def _generate_SWL(self, rv, type):
         """Switch-lock sequence
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the sequences to the lock and the switch
 
         """
         voi = self._g.neighbors(rv, "in")[0]
         vdi = self._g.neighbors(rv, "out")[0]
 
-        roll = self.d100
-        if roll <= 30:
-            type = "C"
-        else:
-            type = "S"
         ln = self._insert_room_btw(voi, vdi, "n", color=color_green)
         fn = self._insert_room_btw(voi, ln, type)
         nv_t = self._insert_room_btw(voi, ln, type)
@@ -810,20 +671,16 @@ class D24(Dungeon):
         self._remove_room(rv, fn, ln)
         return
 
-    def _generate_UI(self, rv):
+    def _generate_UI(self, rv, type):
         """Unique item
 
         Arguments
             rv int:  Reference vertex
+            type str:  Type of the sequence to the item
 
         """
         voi = self._g.neighbors(rv, "in")[0]
 
-        roll = self.d100
-        if roll <= 30:
-            type = "C"
-        else:
-            type = "S"
         fn = self._insert_room_end(voi, type)
         nv_em = self._insert_room_end(fn, "em", color=color_green)
 
@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 
 import argparse
-import logging
+import os
+import sys
 
 from dungeon_fx11 import D24, D30
-
-logging.getLogger().setLevel(logging.DEBUG)
+from utils.batch import parse_seeds, write_ndjson
+from utils.export import EXPORTERS
+from utils.graph_utils import setup_logging
+from utils.render import render_seeds, render_to_directory
 
 
 def main(known_args):
@@ -13,6 +16,7 @@ def main(known_args):
     :returns: TODO
 
     """
+    setup_logging(known_args.debug)
     dungeon_args = {
         'seed': known_args.seed,
         'show_graph': known_args.show_graph,
@@ -20,11 +24,62 @@ def main(known_args):
         'maxiter': known_args.maxiter,
         'maxnodes': known_args.maxnodes,
         'reduce': not known_args.no_reduce,
+        'profile': known_args.profile,
+        'animate': known_args.animate,
+        'budget': known_args.budget,
+        'deadline': known_args.deadline,
+        'maxmemory': known_args.maxmemory,
     }
-    if known_args.post30:
-        D30(**dungeon_args)
+    if known_args.seeds:
+        for arg in ('seed', 'show_graph', 'profile', 'animate'):
+            del dungeon_args[arg]
+        grammar = 'post30' if known_args.post30 else 'post24'
+        if known_args.render:
+            for path in render_seeds(
+                grammar,
+                parse_seeds(known_args.seeds),
+                known_args.render,
+                known_args.format,
+                jobs=known_args.jobs,
+                chunksize=known_args.chunksize,
+                **dungeon_args,
+            ):
+                print(path)
+            return
+        if known_args.archive:
+            from utils.archive import write_archive
+
+            write_archive(
+                known_args.archive,
+                grammar,
+                parse_seeds(known_args.seeds),
+                jobs=known_args.jobs,
+                chunksize=known_args.chunksize,
+                **dungeon_args,
+            )
+            return
+        write_ndjson(
+            sys.stdout,
+            grammar,
+            parse_seeds(known_args.seeds),
+            jobs=known_args.jobs,
+            chunksize=known_args.chunksize,
+            **dungeon_args,
+        )
+        return
+    elif known_args.post30:
+        dungeon = D30(**dungeon_args)
     else:
-        D24(**dungeon_args)
+        dungeon = D24(**dungeon_args)
+    if dungeon.stats:
+        print(dungeon.stats.report(), file=sys.stderr)
+    if known_args.render:
+        os.makedirs(known_args.render, exist_ok=True)
+        print(render_to_directory(dungeon, known_args.render, known_args.format))
+    if known_args.output:
+        print(EXPORTERS[known_args.output](dungeon))
+    if known_args.csr:
+        dungeon.to_csr().save(known_args.csr)
 
 
 if __name__ == "__main__":
@@ -48,11 +103,52 @@ if __name__ == "__main__":
     parser.add_argument(
         "--maxiter", default=200, type=int, help="Maximum number of iterations to perform"
     )
+    parser.add_argument(
+        "--deadline", default=None, type=int, help="Milliseconds the generation may take"
+    )
+    parser.add_argument(
+        "--maxmemory", default=None, type=int, help="Bytes the dungeon graph may take"
+    )
+    parser.add_argument(
+        "--budget",
+        action="store_true",
+        help="Takes the cheapest productions near maxnodes and maxiter to finish the rooms",
+    )
     parser.add_argument("--show-graph", action="store_true", help="Shows graph on generation")
     parser.add_argument(
         "--no-reduce", action="store_true", help="Does not reduce n,e,p adjacent elements"
     )
     parser.add_argument("--debug", action="store_true", help="Debug information")
+    parser.add_argument(
+        "--profile", action="store_true", help="Prints per rule and graph primitive counters"
+    )
+    parser.add_argument(
+        "--seeds", help="Batch mode, seeds to generate as NDJSON (e.g. 1-100000 or 1,5,10-20)"
+    )
+    parser.add_argument(
+        "--jobs", default=None, type=int, help="Worker processes for batch mode (default: CPUs)"
+    )
+    parser.add_argument(
+        "--chunksize", default=32, type=int, help="Seeds sent to a worker at once in batch mode"
+    )
+    parser.add_argument(
+        "--animate", metavar="PATH", help="Saves the generation as a GIF or MP4 animation"
+    )
+    parser.add_argument("--render", metavar="DIR", help="Writes the dungeon images to DIR")
+    parser.add_argument(
+        "--format", default="png", choices=("png", "svg"), help="Image format for --render"
+    )
+    parser.add_argument(
+        "--output", choices=sorted(EXPORTERS), help="Writes the dungeon to the standard output"
+    )
+    parser.add_argument(
+        "--csr", metavar="PATH", help="Saves the graph as CSR arrays in a NumPy .npy file"
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="PATH",
+        help="Batch mode, appends the dungeons to a memory mapped archive indexed by seed",
+    )
     known_args, other_args = parser.parse_known_args()
 
     main(known_args)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+
+from utils.batch import GRAMMARS
+from utils.estimator import SUPPORT, TOLERANCE, estimate
+from utils.graph_utils import setup_logging
+
+
+def main(known_args):
+    """Prints the estimated room counts and limit probabilities of the grammar as JSON"""
+    setup_logging(known_args.debug)
+    result = estimate(
+        known_args.grammar,
+        maxnodes=known_args.maxnodes,
+        maxiter=known_args.maxiter,
+        tolerance=known_args.tolerance,
+        support=known_args.support,
+    )
+    for group in result["divergent"]:
+        print(
+            f"Rules {', '.join(group['rules'])} diverge (spectral radius {group['radius']:.3f})",
+            file=sys.stderr,
+        )
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Estimates the size of the dungeons of a grammar from its production "
+        "probabilities, without generating them"
+    )
+    parser.add_argument(
+        "--grammar", default="post24", choices=list(GRAMMARS), help="Grammar of the dungeons"
+    )
+    parser.add_argument(
+        "--maxnodes", default=300, type=int, help="Maximum number of nodes to include"
+    )
+    parser.add_argument(
+        "--maxiter", default=200, type=int, help="Maximum number of iterations to perform"
+    )
+    parser.add_argument(
+        "--tolerance",
+        default=TOLERANCE,
+        type=float,
+        help="Probability of hitting a limit accepted by the suggested budgets",
+    )
+    parser.add_argument(
+        "--support",
+        default=SUPPORT,
+        type=int,
+        help="Largest iteration or vertex count whose probability is computed",
+    )
+    parser.add_argument("--debug", action="store_true", help="Debug information")
+    known_args, other_args = parser.parse_known_args()
+
+    main(known_args)
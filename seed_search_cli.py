@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+
+from utils.batch import GRAMMARS, parse_seeds
+from utils.graph_utils import setup_logging
+from utils.seed_search import METRICS, parse_constraint, search_seeds
+
+
+def main(known_args):
+    """Prints a JSON line with the seed and metrics of each matching dungeon"""
+    setup_logging(known_args.debug)
+    try:
+        constraints = [parse_constraint(text) for text in known_args.constraints]
+    except ValueError as e:
+        sys.exit(str(e))
+    dungeon_args = {
+        'maxiter': known_args.maxiter,
+        'maxnodes': known_args.maxnodes,
+        'reduce': not known_args.no_reduce,
+    }
+    seeds = parse_seeds(known_args.seeds) if known_args.seeds else None
+    for match in search_seeds(
+        known_args.grammar,
+        constraints,
+        seeds,
+        limit=known_args.limit,
+        jobs=known_args.jobs,
+        chunksize=known_args.chunksize,
+        **dungeon_args,
+    ):
+        print(json.dumps(match), flush=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Finds the seeds of the dungeons that hold all the constraints",
+        epilog=f"Constraints are <metric><op><value> or <metric>=<low>..<high>, like "
+        f"objects.key>=3 rooms.EXIT>=1 vertices=40..60. Metrics: {', '.join(METRICS)}",
+    )
+    parser.add_argument("constraints", nargs="+", help="Constraints to hold")
+    parser.add_argument(
+        "--grammar", default="post24", choices=list(GRAMMARS), help="Grammar of the dungeons"
+    )
+    parser.add_argument(
+        "--seeds", help="Seeds to search (e.g. 1-100000), from 1 onwards by default"
+    )
+    parser.add_argument("--limit", default=10, type=int, help="Stop after this many matches")
+    parser.add_argument(
+        "--maxnodes", default=300, type=int, help="Maximum number of nodes to include"
+    )
+    parser.add_argument(
+        "--maxiter", default=200, type=int, help="Maximum number of iterations to perform"
+    )
+    parser.add_argument(
+        "--no-reduce", action="store_true", help="Does not reduce n,e,p adjacent elements"
+    )
+    parser.add_argument("--jobs", default=None, type=int, help="Worker processes (default: CPUs)")
+    parser.add_argument("--chunksize", default=32, type=int, help="Seeds sent to a worker at once")
+    parser.add_argument("--debug", action="store_true", help="Debug information")
+    known_args, other_args = parser.parse_known_args()
+
+    main(known_args)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+
+from utils.batch import GRAMMARS, parse_seeds
+from utils.graph_utils import setup_logging
+from utils.simulation import simulate
+
+
+def main(known_args):
+    """Prints the room, object and iteration statistics of the seeds as JSON"""
+    setup_logging(known_args.debug)
+    dungeon_args = {
+        'maxiter': known_args.maxiter,
+        'maxnodes': known_args.maxnodes,
+    }
+    hists = simulate(
+        known_args.grammar,
+        parse_seeds(known_args.seeds),
+        jobs=known_args.jobs,
+        chunksize=known_args.chunksize,
+        **dungeon_args,
+    )
+    for error in hists.errors:
+        print(f"Seed {error['seed']} failed: {error['error']}", file=sys.stderr)
+    if known_args.save:
+        hists.save(known_args.save)
+    json.dump(hists.summary(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Counts the rooms and objects the grammar creates for many seeds, "
+        "without building the dungeon graphs"
+    )
+    parser.add_argument(
+        "--grammar", default="post24", choices=list(GRAMMARS), help="Grammar of the dungeons"
+    )
+    parser.add_argument("--seeds", default="1-10000", help="Seeds to simulate (e.g. 1-1000000)")
+    parser.add_argument(
+        "--maxnodes", default=300, type=int, help="Maximum number of nodes to include"
+    )
+    parser.add_argument(
+        "--maxiter", default=200, type=int, help="Maximum number of iterations to perform"
+    )
+    parser.add_argument("--jobs", default=None, type=int, help="Worker processes (default: CPUs)")
+    parser.add_argument("--chunksize", default=256, type=int, help="Seeds sent to a worker at once")
+    parser.add_argument("--save", metavar="PATH", help="Saves the histograms as a NumPy .npz")
+    parser.add_argument("--debug", action="store_true", help="Debug information")
+    known_args, other_args = parser.parse_known_args()
+
+    main(known_args)
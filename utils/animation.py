@@ -0,0 +1,217 @@
+import io
+import math
+import os
+import queue
+import random
+import shutil
+import subprocess
+import threading
+
+from utils.render import draw, fit_limits
+
+FORMATS = ("gif", "mp4")
+# frames of bigger graphs are drawn without labels, they would not be readable
+MAX_LABELS = 100
+
+
+class AnimationCapture:
+    """Captures the generation of a dungeon as an animation
+
+    snapshot() records what changed in the graph since the previous frame (new, recolored
+    and removed vertices plus the edges) and hands it to a background thread. The thread
+    keeps the positions of the vertices between frames: a new vertex starts at the centre of
+    its placed neighbours and a few Fruchterman-Reingold iterations place it with the
+    already placed vertices pinned, so rooms do not jump around. close() waits for the
+    frames and encodes them as a GIF (with Pillow) or an MP4 (with ffmpeg).
+
+    Arguments:
+        path str: Animation file, the extension (gif or mp4) sets the format
+        fps int: Frames per second
+        size tuple: Width and height of the frames in pixels
+        dpi int: Resolution of the frames
+        labels bool: Draw the room names while there are at most MAX_LABELS rooms
+        settle int: Layout iterations to place the new vertices of a frame
+    """
+
+    def __init__(self, path, fps=4, size=(400, 400), dpi=100, labels=True, settle=30):
+        fmt = os.path.splitext(path)[1][1:].lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported animation format {fmt}, use one of {', '.join(FORMATS)}")
+        if fmt == "mp4" and shutil.which("ffmpeg") is None:
+            raise RuntimeError("ffmpeg is needed to encode MP4 animations")
+        self.path = path
+        self.format = fmt
+        self.fps = fps
+        self.size = size
+        self.dpi = dpi
+        self.labels = labels
+        self.settle = settle
+        self.frames = []
+        # state of the capturing thread
+        self._state = {}
+        # state of the rendering thread
+        self._vertices = {}
+        self._positions = {}
+        self._limits = None
+        self._random = random.Random(0)
+        self._error = None
+        self._queue = queue.Queue(maxsize=64)
+        self._thread = threading.Thread(target=self.__run, name="animation", daemon=True)
+        self._thread.start()
+
+    def snapshot(self, dungeon):
+        """Queues a frame with the changes of the dungeon graph since the previous one"""
+        state = {vtx.index: (vtx["name"], vtx["color"]) for vtx in dungeon._g.vs}
+        changed = {vid: value for vid, value in state.items() if self._state.get(vid) != value}
+        removed = [vid for vid in self._state if vid not in state]
+        self._state = state
+        self._queue.put((changed, removed, dungeon._g.get_edgelist()))
+
+    def close(self):
+        """Waits for the pending frames and writes the animation
+
+        Returns:
+            str path of the animation
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        if self.format == "gif":
+            self.__write_gif()
+        else:
+            self.__write_mp4()
+        return self.path
+
+    def __run(self):
+        while True:
+            delta = self._queue.get()
+            if delta is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self.frames.append(self.__render(*delta))
+            except Exception as e:
+                self._error = e
+
+    def __render(self, changed, removed, edges):
+        """Updates the positions with a frame delta and draws it to PNG bytes"""
+        for vid in removed:
+            del self._vertices[vid]
+            self._positions.pop(vid, None)
+        self._vertices.update(changed)
+        vids = list(self._vertices)
+        index = {vid: idx for idx, vid in enumerate(vids)}
+        edges = [(index[s], index[d]) for s, d in edges]
+        coords = self.__layout(vids, edges)
+        limits = fit_limits(coords)
+        if self._limits is not None:
+            # the view only grows, so the rooms already drawn stay in place
+            limits = (
+                min(limits[0], self._limits[0]),
+                max(limits[1], self._limits[1]),
+                min(limits[2], self._limits[2]),
+                max(limits[3], self._limits[3]),
+            )
+        self._limits = limits
+        frame = io.BytesIO()
+        draw(
+            [self._vertices[vid][0] for vid in vids],
+            [self._vertices[vid][1] for vid in vids],
+            edges,
+            coords,
+            frame,
+            "png",
+            self.size,
+            self.dpi,
+            self.labels and len(vids) <= MAX_LABELS,
+            limits,
+        )
+        return frame.getvalue()
+
+    def __layout(self, vids, edges):
+        """Places the vertices without a position, keeping the others where they are"""
+        import igraph
+
+        positions = self._positions
+        new = [idx for idx, vid in enumerate(vids) if vid not in positions]
+        if not new:
+            return [positions[vid] for vid in vids]
+        neighbours = {idx: [] for idx in new}
+        for s, d in edges:
+            if s in neighbours:
+                neighbours[s].append(d)
+            if d in neighbours:
+                neighbours[d].append(s)
+        # new vertices start next to their placed neighbours, in creation order
+        for idx in new:
+            placed = [positions[vids[n]] for n in neighbours[idx] if vids[n] in positions]
+            if placed:
+                x = sum(pos[0] for pos in placed) / len(placed)
+                y = sum(pos[1] for pos in placed) / len(placed)
+            else:
+                x = y = 0.0
+            positions[vids[idx]] = (
+                x + self._random.uniform(-1, 1),
+                y + self._random.uniform(-1, 1),
+            )
+        coords = [positions[vid] for vid in vids]
+        if self.settle:
+            # pin the vertices placed in previous frames, unless all of them are new
+            fresh = set(new) if len(new) < len(vids) else set(range(len(vids)))
+            bounds = {"minx": [], "maxx": [], "miny": [], "maxy": []}
+            for idx, (x, y) in enumerate(coords):
+                free = idx in fresh
+                bounds["minx"].append(-math.inf if free else x)
+                bounds["maxx"].append(math.inf if free else x)
+                bounds["miny"].append(-math.inf if free else y)
+                bounds["maxy"].append(math.inf if free else y)
+            graph = igraph.Graph(n=len(vids), edges=edges, directed=True)
+            coords = graph.layout_fruchterman_reingold(
+                seed=coords, niter=self.settle, **bounds
+            ).coords
+            for idx in fresh:
+                positions[vids[idx]] = tuple(coords[idx])
+        return [positions[vid] for vid in vids]
+
+    def __write_gif(self):
+        from PIL import Image
+
+        images = [Image.open(io.BytesIO(frame)) for frame in self.frames]
+        if not images:
+            return
+        images[0].save(
+            self.path,
+            save_all=True,
+            append_images=images[1:],
+            duration=int(1000 / self.fps),
+            loop=0,
+        )
+
+    def __write_mp4(self):
+        process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "image2pipe",
+                "-framerate",
+                str(self.fps),
+                "-i",
+                "-",
+                "-vf",
+                "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                "-pix_fmt",
+                "yuv420p",
+                self.path,
+            ],
+            stdin=subprocess.PIPE,
+        )
+        for frame in self.frames:
+            process.stdin.write(frame)
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg could not encode {self.path}")
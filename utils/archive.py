@@ -0,0 +1,231 @@
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from utils.batch import CHUNKSIZE, generate_batch
+from utils.csr import CSRGraph
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DGA1"
+VERSION = 1
+# magic, version, grammar, dungeons, index offset, index slots
+HEADER = struct.Struct("<4sI16sQQQ")
+HEADER_SIZE = 64
+# index slots, an open addressing hash table of the seeds, empty slots have length 0
+INDEX = np.dtype([("seed", "<i8"), ("offset", "<u8"), ("length", "<u8")])
+ALIGN = 8
+# multiplier of the Fibonacci hashing of the seeds
+GOLDEN = 0x9E3779B97F4A7C15
+MASK = (1 << 64) - 1
+
+
+class ArchiveWriter:
+    """Appends dungeons to an archive file
+
+    The archive starts with a fixed header, followed by the records, the CSR buffer of
+    each dungeon (see utils.csr), and a hash index of the seeds. The records are only
+    appended: a new index is written after them when the writer is closed, and the header,
+    written last, points to it, so the archive read before the close is still whole if the
+    writer dies. A seed written again replaces the old record in the index.
+
+    Arguments:
+        path str: Archive file, created if it does not exist
+        grammar str: Grammar name of the dungeons, it must match the one of an existing
+            archive
+    """
+
+    def __init__(self, path, grammar):
+        self.path = path
+        self.grammar = grammar
+        self._entries = {}
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with DungeonArchive(path) as archive:
+                if archive.grammar != grammar:
+                    raise ValueError(f"{path} holds {archive.grammar} dungeons, not {grammar}")
+                self._entries = archive.entries()
+            self._file = open(path, "r+b")
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "w+b")
+            self._file.write(bytes(HEADER_SIZE))
+        self.__pad()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, seed, record):
+        """Appends the record of a seed, a CSRGraph or its bytes"""
+        if isinstance(record, np.ndarray):
+            record = record.tobytes()
+        offset = self._file.tell()
+        self._file.write(record)
+        self._entries[int(seed)] = (offset, len(record))
+        self.__pad()
+
+    def close(self):
+        """Writes the index and the header"""
+        if self._file.closed:
+            return
+        index = _index(self._entries)
+        offset = self._file.tell()
+        self._file.write(index.tobytes())
+        self._file.seek(0)
+        self._file.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                self.grammar.encode(),
+                len(self._entries),
+                offset,
+                len(index),
+            )
+        )
+        self._file.close()
+
+    def __pad(self):
+        """Aligns the next record"""
+        self._file.write(bytes(-self._file.tell() % ALIGN))
+
+
+class DungeonArchive:
+    """Memory mapped reader of an archive written by ArchiveWriter
+
+    A dungeon is found by hashing its seed into the index and decoded as a CSRGraph over the
+    mapped file, so getting one does not read the rest of the archive. The dungeons returned
+    keep the file mapped until they are released, even after close.
+
+    Arguments:
+        path str: Archive file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fd:
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, grammar, count, offset, slots = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a dungeon archive")
+        self.grammar = grammar.rstrip(b"\0").decode()
+        self._count = count
+        self._index = np.frombuffer(self._mmap, dtype=INDEX, count=slots, offset=offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, seed):
+        return self.__find(seed) is not None
+
+    def __getitem__(self, seed):
+        entry = self.__find(seed)
+        if entry is None:
+            raise KeyError(seed)
+        offset, length = entry
+        return CSRGraph(np.frombuffer(self._mmap, dtype=np.int32, count=length // 4, offset=offset))
+
+    def __iter__(self):
+        return iter(self.seeds())
+
+    def get(self, seed, default=None):
+        """Returns the dungeon of the seed, default if it is not in the archive"""
+        try:
+            return self[seed]
+        except KeyError:
+            return default
+
+    def seeds(self):
+        """Returns the seeds in the archive, sorted"""
+        return np.sort(self._index["seed"][self._index["length"] > 0])
+
+    def entries(self):
+        """Returns a dict of seed -> (offset, length) of the records"""
+        used = self._index[self._index["length"] > 0]
+        return {
+            int(seed): (int(offset), int(length))
+            for seed, offset, length in zip(used["seed"], used["offset"], used["length"])
+        }
+
+    def close(self):
+        """Unmaps the file, unless dungeons read from it are still referenced"""
+        self._index = self._index[:0].copy()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __find(self, seed):
+        """Returns the (offset, length) of the record of the seed, None if it is not there"""
+        index = self._index
+        slots = len(index)
+        if not slots:
+            return None
+        seed = int(seed)
+        slot = _slot(seed, slots)
+        while True:
+            seeds, offset, length = index[slot].tolist()
+            if not length:
+                return None
+            if seeds == seed:
+                return offset, length
+            slot = (slot + 1) % slots
+
+
+def to_record(dungeon):
+    """Encodes a dungeon as its seed and the bytes of its archive record"""
+    return dungeon._seed, dungeon.to_csr().tobytes()
+
+
+def write_archive(path, grammar, seeds, jobs=None, chunksize=CHUNKSIZE, **dargs):
+    """Generates a dungeon per seed in the batch worker pool and appends them to an archive
+
+    The records are made in the workers and written as they come. The seeds that fail are
+    logged and left out.
+
+    Returns:
+        int number of dungeons written
+    """
+    written = 0
+    with ArchiveWriter(path, grammar) as writer:
+        for result in generate_batch(grammar, seeds, jobs, chunksize, to_record, **dargs):
+            if isinstance(result, dict):
+                logger.warning(f"Seed {result['seed']} failed: {result['error']}")
+                continue
+            writer.add(*result)
+            written += 1
+    return written
+
+
+def _slot(seed, slots):
+    """Home slot of a seed in an index of slots (a power of 2) slots"""
+    bits = slots.bit_length() - 1
+    return ((seed * GOLDEN) & MASK) >> (64 - bits)
+
+
+def _index(entries):
+    """Builds the hash index of a dict of seed -> (offset, length), half of it empty"""
+    slots = 16
+    while slots < 2 * len(entries):
+        slots *= 2
+    index = np.zeros(slots, dtype=INDEX)
+    for seed, (offset, length) in entries.items():
+        slot = _slot(seed, slots)
+        while index["length"][slot]:
+            slot = (slot + 1) % slots
+        index[slot] = (seed, offset, length)
+    return index
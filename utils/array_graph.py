@@ -0,0 +1,427 @@
+from array import array
+
+# approximate bytes taken by a vertex slot, with its attributes and adjacency lists, and by
+# an edge slot, measured with tracemalloc on generated dungeons
+VERTEX_BYTES = 260
+EDGE_BYTES = 72
+# values of the reviewed flags, 0 when it was never set
+REVIEWED = (None, False, True)
+
+
+class VertexAttributes:
+    """Struct of arrays storage of the vertex attributes of a graph
+
+    type and color are small int codes of the strings in _strings, reviewed is a flag per
+    vertex in a bytearray and objects is the index of the list of objects of the vertex in
+    _object_lists, -1 without objects. name and uid are lists of strings, and any other
+    attribute goes to a dict per vertex made on first use. Unset attributes are None.
+    """
+
+    def _init_attributes(self):
+        self._strings = [None]
+        self._codes = {None: 0}
+        self._type = array("H")
+        self._color = array("H")
+        self._reviewed = bytearray()
+        self._name = []
+        self._uid = []
+        self._objects = array("i")
+        self._object_lists = []
+        self._extra = {}
+
+    def _add_attributes(self):
+        """Adds the attribute slots of a new vertex"""
+        self._type.append(0)
+        self._color.append(0)
+        self._reviewed.append(0)
+        self._name.append(None)
+        self._uid.append(None)
+        self._objects.append(-1)
+
+    def _delete_attributes(self, vid):
+        """Frees the attributes of a deleted vertex"""
+        self._name[vid] = None
+        self._uid[vid] = None
+        if self._objects[vid] >= 0:
+            self._object_lists[self._objects[vid]] = None
+            self._objects[vid] = -1
+        self._extra.pop(vid, None)
+
+    def _code(self, value):
+        """Returns the code of a type or color string, adding it if it is new"""
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._strings)
+            self._strings.append(value)
+        return code
+
+    def get_attribute(self, vid, name):
+        """Returns the value of an attribute of a vertex, None if it is not set"""
+        if name == "type":
+            return self._strings[self._type[vid]]
+        if name == "color":
+            return self._strings[self._color[vid]]
+        if name == "reviewed":
+            return REVIEWED[self._reviewed[vid]]
+        if name == "name":
+            return self._name[vid]
+        if name == "uid":
+            return self._uid[vid]
+        if name == "objects":
+            idx = self._objects[vid]
+            return self._object_lists[idx] if idx >= 0 else None
+        extra = self._extra.get(vid)
+        return extra.get(name) if extra else None
+
+    def set_attribute(self, vid, name, value):
+        """Sets the value of an attribute of a vertex"""
+        if name == "type":
+            self._type[vid] = self._code(value)
+        elif name == "color":
+            self._color[vid] = self._code(value)
+        elif name == "reviewed":
+            self._reviewed[vid] = 0 if value is None else 2 if value else 1
+        elif name == "name":
+            self._name[vid] = value
+        elif name == "uid":
+            self._uid[vid] = value
+        elif name == "objects":
+            idx = self._objects[vid]
+            if value is None:
+                if idx >= 0:
+                    self._object_lists[idx] = None
+                    self._objects[vid] = -1
+            elif idx >= 0:
+                self._object_lists[idx] = value
+            else:
+                self._objects[vid] = len(self._object_lists)
+                self._object_lists.append(value)
+        else:
+            self._extra.setdefault(vid, {})[name] = value
+
+    def set_vertex(self, vid, type, color, name, reviewed, uid):
+        """Sets the type, color, name, reviewed and uid of a vertex at once"""
+        self._type[vid] = self._code(type)
+        self._color[vid] = self._code(color)
+        self._name[vid] = name
+        self._reviewed[vid] = 0 if reviewed is None else 2 if reviewed else 1
+        self._uid[vid] = uid
+
+    def attribute_names(self):
+        """Returns the names of the attributes set in any vertex"""
+        names = ["type", "color", "name", "reviewed", "uid"]
+        if any(lst is not None for lst in self._object_lists):
+            names.append("objects")
+        for extra in self._extra.values():
+            names.extend(name for name in extra if name not in names)
+        return names
+
+    def select_vertices(self, filters):
+        """Returns the ids of the live vertices whose attributes equal the values of filters
+
+        type, color and reviewed are compared as codes, without building their values.
+
+        Arguments:
+            filters list: (attribute name, value) pairs
+        """
+        vids = [vid for vid, alive in enumerate(self._alive) if alive]
+        for name, value in filters:
+            if name in ("type", "color"):
+                code = self._codes.get(value)
+                if code is None:
+                    return []
+                column = self._type if name == "type" else self._color
+                vids = [vid for vid in vids if column[vid] == code]
+            elif name == "reviewed":
+                flags = [flag for flag, reviewed in enumerate(REVIEWED) if reviewed == value]
+                column = self._reviewed
+                vids = [vid for vid in vids if column[vid] in flags]
+            else:
+                vids = [vid for vid in vids if self.get_attribute(vid, name) == value]
+        return vids
+
+
+class ArrayGraph(VertexAttributes):
+    """Mutable directed multigraph used while a dungeon is being generated
+
+    Vertices and edges live in flat arrays indexed by id. Deleting a vertex leaves a
+    tombstone instead of reindexing the rest of the graph, and deleted edge slots go to a
+    free list to be reused by the next edge. Vertex ids are never reused, so ordering by id
+    is ordering by creation, which is what the grammars rely on when they pick the first
+    neighbour of a room.
+
+    The vertex attributes are kept as columns, see VertexAttributes. The interface mimics
+    the subset of igraph.Graph used by the grammars, and to_igraph() materializes the final
+    graph.
+    """
+
+    def __init__(self, directed=True, capacity=64):
+        self.directed = directed
+        # vertex arrays
+        self._alive = bytearray()
+        self._init_attributes()
+        self._vin = []
+        self._vout = []
+        # edge arrays
+        self._esrc = [-1] * capacity
+        self._edst = [-1] * capacity
+        self._efree = list(range(capacity - 1, -1, -1))
+        # counters
+        self._vadded = 0
+        self._vdeleted = 0
+        self._eadded = 0
+        self._edeleted = 0
+
+    def __contains__(self, vid):
+        return 0 <= vid < len(self._alive) and self._alive[vid] == 1
+
+    @property
+    def vs(self):
+        return VertexSeq(self)
+
+    def vcount(self):
+        """Number of live vertices"""
+        return self._vadded - self._vdeleted
+
+    def ecount(self):
+        """Number of live edges"""
+        return self._eadded - self._edeleted
+
+    def add_vertex(self):
+        """Adds a vertex and returns it"""
+        vid = len(self._alive)
+        self._alive.append(1)
+        self._add_attributes()
+        self._vin.append([])
+        self._vout.append([])
+        self._vadded += 1
+        return Vertex(self, vid)
+
+    def add_vertices(self, n):
+        """Adds n vertices"""
+        for _ in range(n):
+            self.add_vertex()
+
+    def add_edge(self, source, target):
+        """Adds an edge and returns its id"""
+        source = _vid(source)
+        target = _vid(target)
+        if not self._efree:
+            self.__grow_edges()
+        eid = self._efree.pop()
+        self._esrc[eid] = source
+        self._edst[eid] = target
+        self._vout[source].append(eid)
+        self._vin[target].append(eid)
+        self._eadded += 1
+        return eid
+
+    def add_edges(self, es):
+        """Adds a list of (source, target) edges"""
+        for source, target in es:
+            self.add_edge(source, target)
+
+    def are_connected(self, source, target):
+        """Checks if there is an edge from source to target"""
+        target = _vid(target)
+        edst = self._edst
+        for eid in self._vout[_vid(source)]:
+            if edst[eid] == target:
+                return True
+        return False
+
+    def get_eid(self, source, target):
+        """Returns the id of an edge from source to target
+
+        Raises:
+            ValueError if the vertices are not connected
+        """
+        target = _vid(target)
+        edst = self._edst
+        for eid in self._vout[_vid(source)]:
+            if edst[eid] == target:
+                return eid
+        raise ValueError(f"No edge from {_vid(source)} to {target}")
+
+    def delete_edges(self, es):
+        """Deletes an edge id or a list of edge ids"""
+        if isinstance(es, int):
+            es = (es,)
+        for eid in es:
+            self._vout[self._esrc[eid]].remove(eid)
+            self._vin[self._edst[eid]].remove(eid)
+            self._esrc[eid] = -1
+            self._edst[eid] = -1
+            self._efree.append(eid)
+            self._edeleted += 1
+
+    def delete_vertices(self, vs):
+        """Deletes a vertex or a list of vertices and their edges"""
+        if isinstance(vs, (int, Vertex)):
+            vs = (vs,)
+        for vid in map(_vid, vs):
+            self.delete_edges(list(dict.fromkeys(self._vin[vid] + self._vout[vid])))
+            self._alive[vid] = 0
+            self._delete_attributes(vid)
+            self._vdeleted += 1
+
+    def neighbors(self, vertex, mode="all"):
+        """Returns the ids of the neighbours of a vertex sorted by id"""
+        vid = _vid(vertex)
+        if mode == "out":
+            edst = self._edst
+            return sorted(edst[eid] for eid in self._vout[vid])
+        if mode == "in":
+            esrc = self._esrc
+            return sorted(esrc[eid] for eid in self._vin[vid])
+        return sorted(self.neighbors(vid, "in") + self.neighbors(vid, "out"))
+
+    def simplify(self):
+        """Removes loops and multiple edges"""
+        edst = self._edst
+        for vid, alive in enumerate(self._alive):
+            if not alive:
+                continue
+            seen = set()
+            dupes = []
+            for eid in self._vout[vid]:
+                if edst[eid] == vid or edst[eid] in seen:
+                    dupes.append(eid)
+                seen.add(edst[eid])
+            if dupes:
+                self.delete_edges(dupes)
+
+    def memory(self):
+        """Approximate bytes taken by the graph, from its vertex and edge slots"""
+        return len(self._alive) * VERTEX_BYTES + len(self._esrc) * EDGE_BYTES
+
+    def vertex_ids(self):
+        """Returns the ids of the live vertices in creation order"""
+        return [vid for vid, alive in enumerate(self._alive) if alive]
+
+    def get_edgelist(self):
+        """Returns the live edges as (source, target) id pairs"""
+        return [(s, d) for s, d in zip(self._esrc, self._edst) if s >= 0]
+
+    def to_igraph(self):
+        """Builds an igraph.Graph with the live vertices in id order"""
+        import igraph
+
+        vids = self.vertex_ids()
+        index = {vid: idx for idx, vid in enumerate(vids)}
+        edges = [(index[s], index[d]) for s, d in self.get_edgelist()]
+        vertex_attrs = {
+            name: [self.get_attribute(vid, name) for vid in vids] for name in self.attribute_names()
+        }
+        return igraph.Graph(
+            n=len(vids), edges=edges, directed=self.directed, vertex_attrs=vertex_attrs
+        )
+
+    def __grow_edges(self):
+        """Doubles the edge arrays"""
+        size = len(self._esrc)
+        grow = max(size, 64)
+        self._esrc.extend([-1] * grow)
+        self._edst.extend([-1] * grow)
+        self._efree.extend(range(size + grow - 1, size - 1, -1))
+
+
+class Vertex:
+    """Lightweight view of a vertex in an ArrayGraph"""
+
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.graph.get_attribute(self.index, name)
+
+    def __setitem__(self, name, value):
+        self.graph.set_attribute(self.index, name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, Vertex) and self.graph is other.graph and self.index == other.index
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def __repr__(self):
+        return f"Vertex({self.index}, {self.attributes()})"
+
+    type = property(
+        lambda self: self.graph.get_attribute(self.index, "type"),
+        lambda self, value: self.graph.set_attribute(self.index, "type", value),
+    )
+    color = property(
+        lambda self: self.graph.get_attribute(self.index, "color"),
+        lambda self, value: self.graph.set_attribute(self.index, "color", value),
+    )
+    name = property(
+        lambda self: self.graph.get_attribute(self.index, "name"),
+        lambda self, value: self.graph.set_attribute(self.index, "name", value),
+    )
+    reviewed = property(
+        lambda self: self.graph.get_attribute(self.index, "reviewed"),
+        lambda self, value: self.graph.set_attribute(self.index, "reviewed", value),
+    )
+    uid = property(
+        lambda self: self.graph.get_attribute(self.index, "uid"),
+        lambda self, value: self.graph.set_attribute(self.index, "uid", value),
+    )
+    objects = property(
+        lambda self: self.graph.get_attribute(self.index, "objects"),
+        lambda self, value: self.graph.set_attribute(self.index, "objects", value),
+    )
+
+    def attributes(self):
+        """Returns a dict with the vertex attributes that are set"""
+        graph = self.graph
+        values = {name: graph.get_attribute(self.index, name) for name in graph.attribute_names()}
+        return {name: value for name, value in values.items() if value is not None}
+
+    def neighbors(self, mode="all"):
+        """Returns the neighbour vertices"""
+        return [Vertex(self.graph, vid) for vid in self.graph.neighbors(self.index, mode)]
+
+
+class VertexSeq:
+    """Sequence of the live vertices of an ArrayGraph"""
+
+    __slots__ = ("graph",)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __len__(self):
+        return self.graph.vcount()
+
+    def __getitem__(self, vid):
+        if vid not in self.graph:
+            raise IndexError(f"Vertex {vid} does not exist")
+        return Vertex(self.graph, vid)
+
+    def __iter__(self):
+        graph = self.graph
+        for vid, alive in enumerate(graph._alive):
+            if alive:
+                yield Vertex(graph, vid)
+
+    def select(self, **kwargs):
+        """Selects the vertices whose attributes match name_eq=value filters"""
+        filters = []
+        for key, value in kwargs.items():
+            name, _, op = key.rpartition("_")
+            if op != "eq":
+                raise ValueError(f"Unsupported filter {key}")
+            filters.append((name, value))
+        graph = self.graph
+        return [Vertex(graph, vid) for vid in graph.select_vertices(filters)]
+
+
+def _vid(vertex):
+    """Returns the id of a vertex or vertex id"""
+    if isinstance(vertex, Vertex):
+        return vertex.index
+    return vertex
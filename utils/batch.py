@@ -0,0 +1,159 @@
+import functools
+import importlib
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, islice
+
+GRAMMARS = {
+    "post24": ("dungeon_fx11", "D24"),
+    "post30": ("dungeon_fx11", "D30"),
+    "cyber": ("cyberpuzze", "Cyber"),
+}
+
+CHUNKSIZE = 32
+
+
+def get_grammar(name):
+    """Returns the Dungeon class registered for a grammar name"""
+    try:
+        module, cls = GRAMMARS[name]
+    except KeyError:
+        raise ValueError(f"Unknown grammar {name}, use one of {', '.join(GRAMMARS)}")
+    return getattr(importlib.import_module(module), cls)
+
+
+def parse_seeds(spec):
+    """Parses a seed specification like 1-100,200,300-310
+
+    Returns:
+        iterator over the seeds, in the order given
+    """
+    seeds = []
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        if last < first:
+            raise ValueError(f"Invalid seed range {part}")
+        seeds.append(range(first, last + 1))
+    return chain.from_iterable(seeds)
+
+
+def to_ndjson(dungeon):
+    """Encodes a dungeon as one NDJSON line"""
+    return json.dumps(dungeon.to_dict(), separators=(",", ":"))
+
+
+def generate_batch(grammar, seeds, jobs=None, chunksize=CHUNKSIZE, encoder=to_ndjson, **dargs):
+    """Generates a dungeon per seed in a pool of worker processes
+
+    Seeds are sent to the workers in chunks and the results are yielded in seed order as soon
+    as the chunk they belong to is done. A seed that fails yields an error record instead.
+
+    Arguments:
+        grammar str: Grammar name, a key of GRAMMARS
+        seeds iterable: Seeds to generate
+        jobs int: Number of worker processes (defaults to the number of CPUs)
+        chunksize int: Number of seeds sent to a worker at once
+        encoder function: Module level function applied to each dungeon in the worker
+        dargs: Arguments for the Dungeon (maxnodes, maxiter, reduce...)
+
+    Yields:
+        the encoder result for each seed
+    """
+    jobs = jobs or os.cpu_count() or 1
+    chunks = _chunked(seeds, chunksize)
+    if jobs == 1:
+        # in the caller's process the logs are silenced only while the batch runs
+        graph_logger = logging.getLogger("utils.graph_utils")
+        level = graph_logger.level
+        _init_worker(grammar, dargs.get("debug"))
+        try:
+            for chunk in chunks:
+                yield from _generate_chunk(grammar, chunk, dargs, encoder)
+        finally:
+            graph_logger.setLevel(level)
+        return
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(grammar, dargs.get("debug"))
+    ) as executor:
+        # keep a few chunks per worker in flight so none of them waits for work
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(_generate_chunk, grammar, chunk, dargs, encoder))
+                if len(pending) >= jobs * 4:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # drop the chunks not started yet if the caller stops early
+            executor.shutdown(cancel_futures=True)
+
+
+def generate_threaded(grammar, seeds, threads=None, **dargs):
+    """Generates dungeons in a pool of threads
+
+    Each Dungeon rolls from its own random stream, so no locking is needed and a seed gives
+    the same dungeon whatever else is being generated at the same time.
+
+    Yields:
+        Dungeon objects in seed order
+    """
+    cls = get_grammar(grammar)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        yield from executor.map(functools.partial(_generate_one, cls, dargs), seeds)
+
+
+async def generate_async(grammar, seed, executor=None, **dargs):
+    """Generates a dungeon in an executor (the loop default one if None) from a coroutine"""
+    import asyncio
+
+    cls = get_grammar(grammar)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(cls, seed=seed, **dargs))
+
+
+def write_ndjson(stream, grammar, seeds, jobs=None, chunksize=CHUNKSIZE, **dargs):
+    """Writes one NDJSON line per seed to the stream"""
+    for line in generate_batch(grammar, seeds, jobs, chunksize, to_ndjson, **dargs):
+        if not isinstance(line, str):
+            line = json.dumps(line, separators=(",", ":"))
+        stream.write(line + "\n")
+
+
+def _chunked(seeds, chunksize):
+    """Splits the seeds in lists of chunksize seeds"""
+    seeds = iter(seeds)
+    while True:
+        chunk = list(islice(seeds, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _init_worker(grammar, debug=False):
+    """Imports the grammar once per worker and silences the per dungeon logs"""
+    get_grammar(grammar)
+    if not debug:
+        logging.getLogger("utils.graph_utils").setLevel(logging.CRITICAL)
+
+
+def _generate_one(cls, dargs, seed):
+    """Generates the dungeon of a seed"""
+    return cls(seed=seed, **dargs)
+
+
+def _generate_chunk(grammar, seeds, dargs, encoder):
+    """Generates the dungeons of a chunk of seeds"""
+    cls = get_grammar(grammar)
+    results = []
+    for seed in seeds:
+        try:
+            results.append(encoder(cls(seed=seed, **dargs)))
+        except Exception as e:
+            results.append({"grammar": cls.__name__, "seed": seed, "error": repr(e)})
+    return results
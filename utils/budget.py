@@ -0,0 +1,144 @@
+import math
+
+from utils.estimator import rewrite
+
+# cost tables by grammar class
+_TABLES = {}
+
+
+class CostTable:
+    """Costs of the rooms of a grammar, from one rewrite of each production
+
+    The cost of a room is the number of vertices added and of rewrites made until the room
+    and the rooms it creates are finished, taking the cheapest production of every rule. The
+    caps are not taken into account, they can only make a room cheaper.
+
+    Arguments:
+        cls: Dungeon class
+
+    Attributes:
+        costs dict: Red room type -> (vertices, rewrites) cost, inf when no production
+            finishes the room
+        cheapest dict: Rule symbol -> d100 roll of its cheapest production
+        growth dict: Rule symbol -> expected (vertices, rewrites) cost of the rooms created
+            by a rewrite with a fair roll, the rewrite itself included
+    """
+
+    def __init__(self, cls):
+        rules = cls._rules
+        productions = {}
+        for symbol, rule in rules.items():
+            if rule.thresholds is None:
+                productions[symbol] = [(1.0, 1, rewrite(cls, symbol, 1))]
+                continue
+            productions[symbol] = []
+            low = 0
+            for high in rule.thresholds:
+                if high > low:
+                    productions[symbol].append(
+                        ((high - low) / 100, high, rewrite(cls, symbol, high))
+                    )
+                low = high
+        self.costs = {symbol: (math.inf, math.inf) for symbol in rules}
+        # the cheapest costs are the shortest paths to finished rooms, rounds like Bellman-Ford
+        for _ in range(len(rules) + 1):
+            changed = False
+            for symbol, outcomes in productions.items():
+                cost = min(self.__cost(outcome) for _, _, outcome in outcomes)
+                if cost < self.costs[symbol]:
+                    self.costs[symbol] = cost
+                    changed = True
+            if not changed:
+                break
+        self.cheapest = {}
+        self.growth = {}
+        for symbol, outcomes in productions.items():
+            self.cheapest[symbol] = min(outcomes, key=lambda item: self.__cost(item[2]))[1]
+            costs = [(prob, self.__cost(outcome)) for prob, _, outcome in outcomes]
+            self.growth[symbol] = (
+                sum(prob * cost[0] for prob, cost in costs),
+                sum(prob * cost[1] for prob, cost in costs),
+            )
+
+    def cost(self, type):
+        """Returns the (vertices, rewrites) cost of a red room, a room without rule takes the
+        rewrite that finishes it"""
+        return self.costs.get(type, (0, 1))
+
+    def __cost(self, outcome):
+        """Cost of a rewrite with the outcome, its children finished the cheapest way"""
+        vertices = outcome.vertices
+        rewrites = 1
+        for type, count in outcome.children.items():
+            child = self.cost(type)
+            vertices += count * child[0]
+            rewrites += count * child[1]
+        return vertices, rewrites
+
+
+def cost_table(cls):
+    """Returns the CostTable of a Dungeon class, built once per grammar"""
+    # counting dungeons share the table of the grammar they count
+    grammar = next(base for base in cls.__mro__ if "GRAMMAR" in base.__dict__)
+    if grammar not in _TABLES:
+        _TABLES[grammar] = CostTable(grammar)
+    return _TABLES[grammar]
+
+
+class Budget:
+    """Vertices and iterations left to a generation, which winds it down near the limits
+
+    The rooms waiting to be rewritten are reserved their cheapest cost. A rewrite keeps its
+    roll while the reserved costs plus the expected growth of the rule fit in the limits,
+    otherwise the rule takes its cheapest production and the roll of that production
+    replaces the one in the trace, so the dungeon replays the same. The generation then
+    finishes its rooms instead of leaving them to the red cleanup.
+
+    Arguments:
+        cls: Dungeon class
+        maxnodes int: Maximum number of nodes of the dungeon
+        maxiter int: Maximum number of iterations of the dungeon
+    """
+
+    def __init__(self, cls, maxnodes, maxiter):
+        self.table = cost_table(cls)
+        self.maxnodes = maxnodes
+        self.maxiter = maxiter
+        # reserved cost of the pending rooms
+        self.vertices = 0
+        self.rewrites = 0
+        # rewrites that took the cheapest production instead of the roll
+        self.forced = 0
+        self._last = -1
+
+    def pop(self, dungeon, rv):
+        """Updates the reserve when a room is taken from the worklist to be rewritten"""
+        cost = self.table.cost
+        # the pending rooms are queued in id order, the ones after _last are new
+        if rv.index <= self._last:
+            vertices, rewrites = cost(rv["type"])
+            self.vertices -= vertices
+            self.rewrites -= rewrites
+        pending = dungeon._pending
+        idx = len(pending) - 1
+        while idx >= 0 and pending[idx] > self._last:
+            vertices, rewrites = cost(dungeon._g.vs[pending[idx]]["type"])
+            self.vertices += vertices
+            self.rewrites += rewrites
+            idx -= 1
+        self._last = max(self._last, rv.index, pending[-1] if pending else -1)
+
+    def choose(self, dungeon, rule, roll):
+        """Returns the roll of the production the rule should take"""
+        vertices, rewrites = self.table.growth[rule.symbol]
+        if (
+            dungeon._g.vcount() + self.vertices + vertices <= self.maxnodes
+            and dungeon._niter + self.rewrites + rewrites - 1 <= self.maxiter
+        ):
+            return roll
+        cheapest = self.table.cheapest[rule.symbol]
+        if rule.choose(roll) != rule.choose(cheapest):
+            dungeon._rolls[-1] = cheapest
+            self.forced += 1
+            return cheapest
+        return roll
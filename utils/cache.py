@@ -0,0 +1,160 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+
+from utils.graph_utils import MAXITER, MAXNODE, Dungeon
+from utils.trace import Trace
+
+# Modules besides the grammar ones whose code changes the generated dungeons
+CODE_MODULES = (
+    "utils.array_graph",
+    "utils.color_utils",
+    "utils.dice_roller",
+    "utils.grammar",
+    "utils.string_utils",
+)
+
+
+class DungeonCache:
+    """Cache of generated dungeons
+
+    Dungeons are keyed by (grammar, seed, maxnodes, maxiter, reduce) plus the code version
+    of the grammar, so editing a grammar invalidates its entries. Entries are kept as
+    compressed pickles of Dungeon.to_dict() and the trace bytes in an in-memory LRU with a byte budget and, if a
+    directory is given, in files named after the hash of the key. An entry that cannot be
+    decoded is counted in corrupt and generated again over the bad one.
+
+    A seed of None is not cached, the dungeon gets a random seed like in Dungeon.
+
+    Arguments:
+        max_bytes int: Byte budget of the in-memory tier
+        directory str: Directory of the on-disk tier, None for memory only
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.corrupt = 0
+        self._lru = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, cls, seed, maxnodes=MAXNODE, maxiter=MAXITER, reduce=True):
+        """Returns the dungeon for the arguments, generating it on a miss"""
+        if seed is None:
+            return cls(seed=None, maxnodes=maxnodes, maxiter=maxiter, reduce=reduce)
+        key = self.key(cls, seed, maxnodes, maxiter, reduce)
+        blob = self._get_memory(key)
+        if blob is not None:
+            dungeon = self._load(cls, key, blob)
+            if dungeon is not None:
+                self.hits += 1
+                return dungeon
+        blob = self._get_disk(key)
+        if blob is not None:
+            dungeon = self._load(cls, key, blob)
+            if dungeon is not None:
+                self.disk_hits += 1
+                self._put_memory(key, blob)
+                return dungeon
+        self.misses += 1
+        dungeon = cls(seed=seed, maxnodes=maxnodes, maxiter=maxiter, reduce=reduce)
+        entry = (dungeon.to_dict(), dungeon.trace.to_bytes())
+        blob = zlib.compress(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL), 1)
+        self._put_disk(key, blob)
+        self._put_memory(key, blob)
+        return dungeon
+
+    def clear(self):
+        """Empties the in-memory tier"""
+        with self._lock:
+            self._lru.clear()
+            self._nbytes = 0
+
+    def key(self, cls, seed, maxnodes, maxiter, reduce):
+        """Returns the hex digest identifying an entry"""
+        key = (
+            f"{cls.__module__}.{cls.__qualname__}:{int(seed)}:{maxnodes}:{maxiter}:{bool(reduce)}"
+            f":{code_version(cls)}"
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _load(self, cls, key, blob):
+        """Decodes an entry, None if it is damaged, which drops it from the memory tier"""
+        try:
+            data, trace = pickle.loads(zlib.decompress(blob))
+            return cls.from_dict(data, Trace.from_bytes(trace))
+        except Exception:
+            # zlib, pickle and a to_dict of other shape fail with many exception types
+            self.corrupt += 1
+            with self._lock:
+                if self._lru.get(key) is blob:
+                    del self._lru[key]
+                    self._nbytes -= len(blob)
+            return None
+
+    def _get_memory(self, key):
+        with self._lock:
+            blob = self._lru.get(key)
+            if blob is not None:
+                self._lru.move_to_end(key)
+            return blob
+
+    def _put_memory(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._lru:
+                return
+            self._lru[key] = blob
+            self._nbytes += len(blob)
+            while self._nbytes > self.max_bytes:
+                _, old = self._lru.popitem(last=False)
+                self._nbytes -= len(old)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _get_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "rb") as fd:
+                return fd.read()
+        except FileNotFoundError:
+            return None
+
+    def _put_disk(self, key, blob):
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fd:
+            fd.write(blob)
+        os.replace(tmp, path)
+
+
+_code_versions = {}
+
+
+def code_version(cls):
+    """Returns a hash of the source of the modules that generate the dungeons of a class"""
+    version = _code_versions.get(cls)
+    if version is None:
+        modules = [base.__module__ for base in cls.__mro__ if issubclass(base, Dungeon)]
+        digest = hashlib.sha256()
+        for name in sorted(set(modules) | set(CODE_MODULES)):
+            with open(sys.modules[name].__file__, "rb") as fd:
+                digest.update(fd.read())
+        version = _code_versions[cls] = digest.hexdigest()[:16]
+    return version
@@ -0,0 +1,246 @@
+import logging
+import sqlite3
+from collections import Counter
+
+from utils.batch import CHUNKSIZE, generate_batch
+from utils.seed_search import parse_constraint, path_metric
+
+logger = logging.getLogger(__name__)
+
+# dungeon columns, the metrics of utils.seed_search without a type
+COLUMNS = ("vertices", "edges", "iterations", "path")
+# the generation arguments that change the dungeon of a seed
+LIMITS = ("maxnodes", "maxiter", "reduce", "budget")
+SQL_OPERATORS = {">=": ">=", "<=": "<=", "==": "=", "=": "=", "!=": "!=", ">": ">", "<": "<"}
+# rows inserted per transaction
+BATCH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dungeons (
+    id INTEGER PRIMARY KEY,
+    grammar TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    maxnodes INTEGER NOT NULL,
+    maxiter INTEGER NOT NULL,
+    reduce INTEGER NOT NULL,
+    budget INTEGER NOT NULL,
+    status TEXT,
+    vertices INTEGER NOT NULL,
+    edges INTEGER NOT NULL,
+    iterations INTEGER NOT NULL,
+    path INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS dungeons_key
+    ON dungeons (grammar, maxnodes, maxiter, reduce, budget, seed);
+CREATE INDEX IF NOT EXISTS dungeons_vertices ON dungeons (vertices);
+CREATE INDEX IF NOT EXISTS dungeons_edges ON dungeons (edges);
+CREATE INDEX IF NOT EXISTS dungeons_iterations ON dungeons (iterations);
+CREATE INDEX IF NOT EXISTS dungeons_path ON dungeons (path);
+CREATE TABLE IF NOT EXISTS counts (
+    dungeon INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (dungeon, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS counts_metric ON counts (metric, value, dungeon);
+"""
+
+
+def to_row(dungeon):
+    """Encodes the metrics of a dungeon as a catalog row
+
+    Returns:
+        tuple of the seed, the limits, the status, the COLUMNS values and a dict of the
+        rooms.<type>, objects.<type> and type.<type> counts that are not 0
+    """
+    graph = dungeon._g
+    counts = {f"rooms.{type}": count for type, count in dungeon._rooms.items() if count}
+    for type, count in Counter(obj.type for obj in dungeon._objects).items():
+        counts[f"objects.{type}"] = count
+    for type, count in Counter(vtx["type"] for vtx in graph.vs).items():
+        counts[f"type.{type}"] = count
+    limits = (
+        dungeon._maxnode + 1,
+        dungeon._maxiter + 1,
+        int(dungeon._reduce),
+        int(dungeon._budget is not None),
+    )
+    values = (graph.vcount(), graph.ecount(), dungeon._niter, path_metric(dungeon))
+    return (dungeon._seed,) + limits + (dungeon.status,) + values + (counts,)
+
+
+class Catalog:
+    """SQLite database of the metrics of generated dungeons
+
+    Every dungeon is a row of the dungeons table, keyed by its grammar, limits and seed, with
+    the COLUMNS metrics, and the counts of its rooms and objects are rows of the counts table.
+    Both are indexed by value, so the constraints of utils.seed_search are answered from the
+    indexes instead of generating the dungeons again. A count missing from the table is 0.
+
+    The database is in WAL mode, so it can be queried while the rows are inserted.
+
+    Arguments:
+        path str: Database file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM dungeons").fetchone()[0]
+
+    def close(self):
+        """Updates the query planner statistics and closes the database"""
+        self._db.execute("PRAGMA optimize")
+        self._db.close()
+
+    def add(self, grammar, rows):
+        """Inserts the rows made by to_row in a single transaction, replacing the dungeons
+        already in the catalog with the same grammar, limits and seed"""
+        # a seed given twice keeps its last row
+        rows = list({row[:5]: row for row in rows}.values())
+        keys = [(grammar,) + row[1:5] + row[:1] for row in rows]
+        where = (
+            "grammar = ? AND maxnodes = ? AND maxiter = ? AND reduce = ? AND budget = ? "
+            "AND seed = ?"
+        )
+        with self._db:
+            self._db.executemany(
+                f"DELETE FROM counts WHERE dungeon = (SELECT id FROM dungeons WHERE {where})",
+                keys,
+            )
+            self._db.executemany(f"DELETE FROM dungeons WHERE {where}", keys)
+            first = self._db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM dungeons").fetchone()[0]
+            self._db.executemany(
+                "INSERT INTO dungeons VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((first + idx, grammar) + row[:-1] for idx, row in enumerate(rows)),
+            )
+            self._db.executemany(
+                "INSERT INTO counts VALUES (?, ?, ?)",
+                (
+                    (first + idx, metric, value)
+                    for idx, row in enumerate(rows)
+                    for metric, value in row[-1].items()
+                ),
+            )
+
+    def query(self, grammar, constraints, limit=None, **dargs):
+        """Searches the dungeons that hold all the constraints
+
+        Arguments:
+            grammar str: Grammar name, a key of utils.batch.GRAMMARS
+            constraints list: Constraint objects or constraint strings
+            limit int: Maximum number of matches, None for all of them
+            dargs: Limits of the dungeons (maxnodes, maxiter, reduce, budget), any if missing
+
+        Returns:
+            list of dicts with the seed and the value of each metric, like
+            utils.seed_search.search_seeds, in seed order
+        """
+        constraints = [
+            parse_constraint(constraint) if isinstance(constraint, str) else constraint
+            for constraint in constraints
+        ]
+        sql, params = _query(grammar, constraints, limit, dargs)
+        return [
+            {
+                "seed": row[0],
+                "metrics": {
+                    constraint.metric: value for constraint, value in zip(constraints, row[1:])
+                },
+            }
+            for row in self._db.execute(sql, params)
+        ]
+
+
+def write_catalog(path, grammar, seeds, jobs=None, chunksize=CHUNKSIZE, **dargs):
+    """Generates a dungeon per seed in the batch worker pool and adds them to a catalog
+
+    The rows are made in the workers and inserted BATCH at a time. The seeds that fail are
+    logged and left out.
+
+    Returns:
+        int number of dungeons added
+    """
+    added = 0
+    rows = []
+    with Catalog(path) as catalog:
+        for result in generate_batch(grammar, seeds, jobs, chunksize, to_row, **dargs):
+            if isinstance(result, dict):
+                logger.warning(f"Seed {result['seed']} failed: {result['error']}")
+                continue
+            rows.append(result)
+            if len(rows) >= BATCH:
+                catalog.add(grammar, rows)
+                added += len(rows)
+                rows = []
+        catalog.add(grammar, rows)
+        added += len(rows)
+    return added
+
+
+def _condition(constraint, column):
+    """SQL condition and parameters of a constraint over a column"""
+    if constraint.high is not None:
+        return f"{column} BETWEEN ? AND ?", [constraint.low, constraint.high]
+    return f"{column} {SQL_OPERATORS[constraint.op]} ?", [constraint.low]
+
+
+def _query(grammar, constraints, limit, dargs):
+    """Builds the SQL query of the constraints
+
+    A count that 0 does not satisfy needs a row in the counts table, so it is a join on the
+    (metric, value) index. One that 0 satisfies excludes the dungeons with a count that does
+    not, so the dungeons without the count are found too.
+    """
+    select = ["d.seed"]
+    joins = []
+    where = ["d.grammar = ?"]
+    select_params = []
+    join_params = []
+    where_params = [grammar]
+    for name in LIMITS:
+        if dargs.get(name) is not None:
+            where.append(f"d.{name} = ?")
+            where_params.append(int(dargs[name]))
+    for idx, constraint in enumerate(constraints):
+        name = constraint.metric.partition(".")[0]
+        if name in COLUMNS:
+            condition, params = _condition(constraint, f"d.{name}")
+            select.append(f"d.{name}")
+            where.append(condition)
+            where_params.extend(params)
+        elif constraint.check(0):
+            condition, params = _condition(constraint, "value")
+            select.append(
+                "COALESCE((SELECT value FROM counts WHERE dungeon = d.id AND metric = ?), 0)"
+            )
+            select_params.append(constraint.metric)
+            where.append(
+                f"d.id NOT IN (SELECT dungeon FROM counts WHERE metric = ? AND NOT ({condition}))"
+            )
+            where_params.extend([constraint.metric] + params)
+        else:
+            condition, params = _condition(constraint, f"c{idx}.value")
+            select.append(f"c{idx}.value")
+            joins.append(
+                f"JOIN counts c{idx} ON c{idx}.dungeon = d.id AND c{idx}.metric = ? AND {condition}"
+            )
+            join_params.extend([constraint.metric] + params)
+    sql = (
+        f"SELECT {', '.join(select)} FROM dungeons d {' '.join(joins)} WHERE {' AND '.join(where)}"
+    )
+    sql += " ORDER BY d.seed"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql, select_params + join_params + where_params
@@ -0,0 +1,164 @@
+import json
+
+import numpy as np
+
+MAGIC = 0x52534344
+VERSION = 1
+# magic, version, vertices, edges, object references, metadata bytes
+HEADER = 6
+
+
+class CSRGraph(np.ndarray):
+    """Dungeon graph in compressed sparse row form, in a single int32 buffer
+
+    The buffer holds the header, the arrays below and the metadata as JSON bytes, one after
+    the other, so the whole dungeon is one ndarray that supports the buffer protocol and can
+    be written with np.save and read back with CSRGraph.load, memory mapped if wanted. The
+    arrays are views of the buffer. The vertices are numbered in creation order like in
+    Dungeon.to_dict.
+
+        indptr: out edges of vertex i are indices[indptr[i]:indptr[i + 1]]
+        indices: target vertex of each edge
+        types: code of the type of each vertex, an index of meta["types"]
+        object_indptr: objects of vertex i are objects[object_indptr[i]:object_indptr[i + 1]]
+        objects: objects of the vertices, indexes of meta["objects"]
+
+    The ufuncs and slices of a CSRGraph give plain ndarrays.
+
+    Arguments:
+        buffer: int32 array made by to_csr, or loaded from a file
+    """
+
+    def __new__(cls, buffer):
+        array = np.asarray(buffer)
+        if array.dtype != np.int32 or array.ndim != 1 or len(array) < HEADER:
+            raise ValueError("Not a CSR dungeon buffer")
+        if array[0] != MAGIC or array[1] != VERSION:
+            raise ValueError("Not a CSR dungeon buffer")
+        return array.view(cls)
+
+    def __array_wrap__(self, array, context=None, return_scalar=False):
+        array = array.view(np.ndarray)
+        return array[()] if return_scalar else array
+
+    def __getitem__(self, key):
+        return self.view(np.ndarray)[key]
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Loads a CSRGraph saved with np.save, memory mapped with mmap_mode="r" """
+        return cls(np.load(path, mmap_mode=mmap_mode))
+
+    def save(self, path):
+        """Saves the buffer as a NumPy .npy file"""
+        np.save(path, self.view(np.ndarray))
+
+    @property
+    def vcount(self):
+        return int(self[2])
+
+    @property
+    def ecount(self):
+        return int(self[3])
+
+    @property
+    def indptr(self):
+        return self.__section(0)
+
+    @property
+    def indices(self):
+        return self.__section(1)
+
+    @property
+    def types(self):
+        return self.__section(2)
+
+    @property
+    def object_indptr(self):
+        return self.__section(3)
+
+    @property
+    def objects(self):
+        return self.__section(4)
+
+    @property
+    def meta(self):
+        """dict with the grammar, the seed, the type names and the objects of the dungeon"""
+        raw = self.__section(5).tobytes()
+        end = int(self[5])
+        return json.loads(raw[:end])
+
+    def type_names(self):
+        """Returns the type name of each vertex, the only per vertex Python objects made"""
+        names = np.array(self.meta["types"], dtype=object)
+        return names[self.types]
+
+    def __section(self, idx):
+        sizes = _sizes(int(self[2]), int(self[3]), int(self[4]), int(self[5]))
+        start = HEADER + sum(sizes[:idx])
+        end = start + sizes[idx]
+        return self.view(np.ndarray)[start:end]
+
+
+def to_csr(dungeon):
+    """Returns the graph of a dungeon as a CSRGraph
+
+    The arrays are built from the columns of the ArrayGraph, without making a Python object
+    per vertex or edge.
+    """
+    graph = dungeon._g
+    alive = np.frombuffer(graph._alive, dtype=np.uint8).astype(bool)
+    vids = np.flatnonzero(alive)
+    index = np.cumsum(alive) - 1
+    sources = np.array(graph._esrc, dtype=np.int64)
+    targets = np.array(graph._edst, dtype=np.int64)
+    live = sources >= 0
+    sources = index[sources[live]]
+    targets = index[targets[live]]
+    # the out edges of each vertex keep the order of their slots, like get_edgelist
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(len(vids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(vids)), out=indptr[1:])
+    codes = np.frombuffer(graph._type, dtype=np.uint16)[vids]
+    used, types = np.unique(codes, return_inverse=True)
+    # only the rooms with objects are visited
+    object_ids = {id(obj): idx for idx, obj in enumerate(dungeon._objects)}
+    lists = np.frombuffer(graph._objects, dtype=np.int32)[vids]
+    counts = np.zeros(len(vids), dtype=np.int64)
+    refs = []
+    for idx in np.flatnonzero(lists >= 0):
+        objects = graph._object_lists[lists[idx]]
+        counts[idx] = len(objects)
+        refs.extend(object_ids[id(obj)] for obj in objects)
+    object_indptr = np.zeros(len(vids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=object_indptr[1:])
+    meta = json.dumps(
+        {
+            "grammar": type(dungeon).__name__,
+            "seed": dungeon._seed,
+            "types": [graph._strings[code] for code in used],
+            "objects": [
+                {"type": obj.type, "name": obj.name, "uid": obj.uid} for obj in dungeon._objects
+            ],
+        },
+        separators=(",", ":"),
+    ).encode()
+    padded = meta + b"\0" * (-len(meta) % 4)
+    header = [MAGIC, VERSION, len(vids), len(targets), len(refs), len(meta)]
+    buffer = np.concatenate(
+        [
+            np.array(header, dtype=np.int32),
+            indptr.astype(np.int32),
+            targets[order].astype(np.int32),
+            types.astype(np.int32),
+            object_indptr.astype(np.int32),
+            np.array(refs, dtype=np.int32),
+            np.frombuffer(padded, dtype=np.int32),
+        ]
+    )
+    return CSRGraph(buffer)
+
+
+def _sizes(vertices, edges, refs, meta):
+    """Lengths in int32 of the sections of the buffer after the header"""
+    return (vertices + 1, edges, vertices, vertices + 1, refs, (meta + 3) // 4)
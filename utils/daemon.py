@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.batch import GRAMMARS, get_grammar
+from utils.export import EXPORTERS
+
+logger = logging.getLogger(__name__)
+
+# Request fields passed to the Dungeon
+DUNGEON_ARGS = ("seed", "maxnodes", "maxiter", "reduce", "budget", "deadline", "maxmemory")
+TIMEOUT = 30.0
+# Latencies kept for the stats percentiles
+LATENCIES = 1000
+# Longest request line in bytes
+LINE_LIMIT = 64 * 1024
+
+
+class DungeonDaemon:
+    """Generation server over a Unix domain socket
+
+    Clients send one JSON object per line and get one JSON object per line back, with the id
+    of the request. Requests on a connection are served concurrently, so the responses may
+    come back in a different order.
+
+        {"id": 1, "cmd": "generate", "grammar": "post30", "seed": 5, "format": "json"}
+        {"id": 1, "ok": true, "result": {...}}
+        {"id": 2, "cmd": "stats"}
+        {"id": 2, "ok": true, "result": {"requests": 2, ...}}
+
+    generate accepts seed, maxnodes, maxiter, reduce, budget, deadline, maxmemory, format
+    (json, edgelist or dot) and timeout. The dungeons are generated in a pool of worker processes that import every
+    grammar on start. At most max_pending generations are queued or running; when they are
+    all taken the daemon stops reading from the connections until one finishes, so the
+    clients feel the backpressure on their sockets. A timed out request gets an error
+    response, but its generation keeps its pool slot until it is done since running workers
+    cannot be interrupted.
+
+    Arguments:
+        path str: Path of the socket
+        jobs int: Number of worker processes (defaults to the number of CPUs)
+        max_pending int: Generations queued or running at once (defaults to 4 per worker)
+        timeout float: Default seconds to wait for a generation
+    """
+
+    def __init__(self, path, jobs=None, max_pending=None, timeout=TIMEOUT):
+        self.path = path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_pending = max_pending or self.jobs * 4
+        self.timeout = timeout
+        self.counters = {
+            "requests": 0,
+            "completed": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "throttled": 0,
+            "pending": 0,
+            "connections": 0,
+        }
+        self._latencies = deque(maxlen=LATENCIES)
+        self._started = None
+        self._slots = None
+        self._executor = None
+
+    async def serve(self):
+        """Serves requests until the process gets SIGINT or SIGTERM"""
+        loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._started = time.monotonic()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # the workers are started on demand, forked from the daemon they would keep the client
+        # sockets open at the time
+        context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, mp_context=context, initializer=_init_worker
+        ) as executor:
+            self._executor = executor
+            server = await asyncio.start_unix_server(self._handle, path=self.path, limit=LINE_LIMIT)
+            logger.info(f"Serving on {self.path} with {self.jobs} workers")
+            async with server:
+                await stop.wait()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def stats(self):
+        """Returns the counters, the uptime and the latency percentiles in seconds"""
+        latencies = sorted(self._latencies)
+        stats = dict(self.counters)
+        stats["uptime"] = time.monotonic() - self._started if self._started else 0.0
+        stats["workers"] = self.jobs
+        stats["max_pending"] = self.max_pending
+        for pct in (50, 99):
+            stats[f"p{pct}"] = (
+                latencies[min(len(latencies) - 1, len(latencies) * pct // 100)]
+                if latencies
+                else None
+            )
+        return stats
+
+    async def _handle(self, reader, writer):
+        self.counters["connections"] += 1
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # readline raises ValueError for a line over the stream limit
+                    self.counters["errors"] += 1
+                    response = {"id": None, "ok": False, "error": "request too long"}
+                    writer.write((json.dumps(response) + "\n").encode())
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # no more requests are read from the connection until there is a free slot
+                if self._slots.locked():
+                    self.counters["throttled"] += 1
+                await self._slots.acquire()
+                task = asyncio.create_task(self._serve(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Connection closed: {e!r}")
+        finally:
+            # the requests in flight answer before the connection is closed
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            self.counters["connections"] -= 1
+            writer.close()
+
+    async def _serve(self, line, writer):
+        """Answers a request line, releasing the slot taken for it by the connection"""
+        self.counters["requests"] += 1
+        rid = None
+        owned = True
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("The request must be a JSON object")
+            rid = request.get("id")
+            cmd = request.get("cmd", "generate")
+            if cmd == "generate":
+                owned = False
+                result = await self._generate(request)
+            elif cmd == "stats":
+                result = json.dumps(self.stats())
+            elif cmd == "ping":
+                result = '"pong"'
+            else:
+                raise ValueError(f"Unknown command {cmd}")
+            response = f'{{"id":{json.dumps(rid)},"ok":true,"result":{result}}}\n'
+        except Exception as e:
+            self.counters["errors"] += 1
+            error = str(e) or type(e).__name__
+            response = json.dumps({"id": rid, "ok": False, "error": error}) + "\n"
+        finally:
+            if owned:
+                self._slots.release()
+        writer.write(response.encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _generate(self, request):
+        """Runs a generation in the pool and returns its result as a JSON fragment
+
+        The slot of the request is released when the worker is done, even if the request
+        timed out before.
+        """
+        try:
+            grammar = request.get("grammar", "post24")
+            if grammar not in GRAMMARS:
+                raise ValueError(f"Unknown grammar {grammar}, use one of {', '.join(GRAMMARS)}")
+            fmt = request.get("format", "json")
+            if fmt not in EXPORTERS:
+                raise ValueError(f"Unknown format {fmt}, use one of {', '.join(EXPORTERS)}")
+            dargs = {name: request[name] for name in DUNGEON_ARGS if name in request}
+            timeout = float(request.get("timeout", self.timeout))
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, _generate, grammar, dargs, fmt)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.counters["pending"] += 1
+        future.add_done_callback(self._release)
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise TimeoutError(f"Generation took more than {timeout}s")
+        self.counters["completed"] += 1
+        self._latencies.append(time.monotonic() - start)
+        return result
+
+    def _release(self, future):
+        self.counters["pending"] -= 1
+        self._slots.release()
+        if not future.cancelled():
+            # retrieve the exception of abandoned futures so it is not logged
+            future.exception()
+
+
+def request(path, message, timeout=None):
+    """Sends a request to a daemon and returns its response, for clients in Python
+
+    Arguments:
+        path str: Path of the daemon socket
+        message dict: Request
+        timeout float: Seconds to wait for the response
+
+    Returns:
+        dict response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as fd:
+            return json.loads(fd.readline())
+
+
+def _init_worker():
+    """Imports every grammar once per worker and silences the per dungeon logs"""
+    for name in GRAMMARS:
+        get_grammar(name)
+    logging.getLogger("utils.graph_utils").setLevel(logging.CRITICAL)
+
+
+def _generate(grammar, dargs, fmt):
+    """Generates a dungeon and returns it as a JSON fragment"""
+    dungeon = get_grammar(grammar)(**dargs)
+    if fmt == "json":
+        return EXPORTERS[fmt](dungeon)
+    return json.dumps(EXPORTERS[fmt](dungeon))
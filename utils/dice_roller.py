@@ -3,49 +3,50 @@ import random
 
 class DiceRoller():
 
-    def __init__(self):
-        pass
+    def __init__(self, rng=None):
+        """Rolls dice with the rng random.Random stream (defaults to the random module)"""
+        self._rng = rng if rng is not None else random
 
     @property
     def d2(self):
-        return random.randint(1, 2)
+        return self._rng.randint(1, 2)
 
     @property
     def d4(self):
-        return random.randint(1, 4)
+        return self._rng.randint(1, 4)
 
     @property
     def d6(self):
-        return random.randint(1, 6)
+        return self._rng.randint(1, 6)
 
     @property
     def d8(self):
-        return random.randint(1, 8)
+        return self._rng.randint(1, 8)
 
     @property
     def d10(self):
-        return random.randint(1, 10)
+        return self._rng.randint(1, 10)
 
     @property
     def d12(self):
-        return random.randint(1, 12)
+        return self._rng.randint(1, 12)
 
     @property
     def d20(self):
-        return random.randint(1, 20)
+        return self._rng.randint(1, 20)
 
     @property
     def d66(self):
-        return random.randint(1, 6) * 10 + random.randint(1, 6)
+        return self._rng.randint(1, 6) * 10 + self._rng.randint(1, 6)
 
     @property
     def d100(self):
-        return random.randint(1, 100)
+        return self._rng.randint(1, 100)
 
     @property
     def dsombra(self):
-        dsombra = random.randint(1, 10)
-        dadosq = [random.randint(1, 10) for i in range(2)]
+        dsombra = self._rng.randint(1, 10)
+        dadosq = [self._rng.randint(1, 10) for i in range(2)]
         dadosq.sort()
         dmin, dmax = dadosq
         return f'({dsombra}) {dmax} {dmin} : {dsombra+dmax+dmin}'
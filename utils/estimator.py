@@ -0,0 +1,548 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from utils.batch import get_grammar
+from utils.color_utils import color_red
+from utils.simulation import counting
+
+# the rewrites are enumerated over the faces of the d100
+FACES = 100
+# the rooms named after a numbered object are grouped, "Use key 3" is counted as "Use key #"
+OBJECT_NUMBER = re.compile(r" \d+")
+EPSILON = 1e-9
+# largest iteration or vertex count whose probability is computed
+SUPPORT = 1024
+# generations followed before the process is taken as stationary
+GENERATIONS = 256
+# positions in a generation averaged over by the cap correction
+POSITIONS = 16
+# probability of hitting a limit accepted by the suggested budgets
+TOLERANCE = 0.01
+
+
+def room_class(type):
+    """Returns the class a room type is counted in, the type without its object number"""
+    return OBJECT_NUMBER.sub(" #", type)
+
+
+class Outcome:
+    """Result of a rewrite for a set of faces of the d100
+
+    Arguments:
+        prob float: Probability of the outcome
+        children dict: Red rooms created by type, the rooms rewritten next
+        rooms dict: Rooms created by class, see room_class
+        vertices int: Change of the number of vertices of the graph
+    """
+
+    __slots__ = ("prob", "children", "rooms", "vertices")
+
+    def __init__(self, prob, children, rooms, vertices):
+        self.prob = prob
+        self.children = children
+        self.rooms = rooms
+        self.vertices = vertices
+
+    def __repr__(self):
+        return f"Outcome({self.prob}, {self.children}, {self.rooms}, {self.vertices})"
+
+
+def probe(cls):
+    """Enumerates the outcomes of the start and of the rules of a grammar
+
+    Every rewrite is run once per face of the d100, see rewrite.
+
+    Returns:
+        tuple with the outcomes of the start and a dict of red room type -> outcomes, for
+        the types that can be reached from the start
+    """
+    start = _enumerate(cls, None)
+    outcomes = {}
+    todo = [symbol for outcome in start for symbol in outcome.children]
+    while todo:
+        symbol = todo.pop()
+        if symbol not in outcomes:
+            outcomes[symbol] = _enumerate(cls, symbol)
+            todo.extend(child for outcome in outcomes[symbol] for child in outcome.children)
+    return start, outcomes
+
+
+class GrammarModel:
+    """Multitype branching process of a grammar
+
+    Each red room type is a type of the process, and the red rooms created when a room is
+    rewritten are its offspring. The caps are not part of a branching process, so they are
+    approximated generation by generation: the number of capped rooms created is followed as
+    a distribution and the other rooms by their expected number, which gives the probability
+    of rewriting a capped room of each generation. With the caps turned into those
+    probabilities the moments and the distributions of the process are solved exactly.
+
+    Arguments:
+        cls: Dungeon class
+    """
+
+    def __init__(self, cls):
+        self.grammar = cls.__name__
+        start, outcomes = probe(cls)
+        self.symbols = sorted(outcomes)
+        self.classes = sorted(
+            {name for outcome in start for name in outcome.rooms}
+            | {name for rule in outcomes.values() for outcome in rule for name in outcome.rooms}
+        )
+        self._symbols = {symbol: idx for idx, symbol in enumerate(self.symbols)}
+        self._classes = {name: idx for idx, name in enumerate(self.classes)}
+        self.caps = np.array([_cap(cls._rules.get(symbol)) for symbol in self.symbols])
+        self.start = self.__arrays(start)
+        self.rules = [self.__arrays(outcomes[symbol]) for symbol in self.symbols]
+        # expected offspring and rooms of a rewrite
+        self.mean = np.array([probs @ children for probs, children, _, _ in self.rules])
+        self.rooms = np.array([probs @ rooms for probs, _, rooms, _ in self.rules])
+
+    def divergent(self):
+        """Finds the groups of rules whose expected expansion diverges
+
+        The rules that can rewrite each other form a group, and the expected number of
+        rewrites in a group is infinite when the spectral radius of its mean offspring
+        matrix is at least 1.
+
+        Returns:
+            list of dicts with the rules of each divergent group, its spectral radius and
+            the caps that bound it, empty if only maxnodes and maxiter stop it
+        """
+        groups = []
+        for group in _components(self.mean > 0):
+            radius = _radius(self.mean[np.ix_(group, group)])
+            if radius < 1 - EPSILON:
+                continue
+            groups.append(
+                {
+                    "rules": [self.symbols[idx] for idx in group],
+                    "radius": radius,
+                    "caps": {
+                        self.symbols[idx]: int(self.caps[idx])
+                        for idx in group
+                        if math.isfinite(self.caps[idx])
+                    },
+                }
+            )
+        return groups
+
+    def thinning(self):
+        """Probability of rewriting a room of each type in each generation
+
+        The first generation is made of the red rooms of the start. The rooms created earlier
+        in a generation count for the caps of the rooms rewritten later in it.
+
+        Returns:
+            tuple with an array with a row per generation and a column per red room type,
+            and the row the later generations repeat (None if no rooms are left by then)
+        """
+        n = len(self.symbols)
+        capped = np.flatnonzero(np.isfinite(self.caps))
+        if not len(capped):
+            return np.ones((1, n)), np.ones(n)
+        caps = self.caps[capped].astype(int)
+        shape = tuple(caps + 1)
+        kappa = np.array(list(np.ndindex(*shape)))
+        left = caps - kappa
+        # the types whose rewrites lead to each capped type
+        feeds = _closure(self.mean > 0)[:, capped].T.astype(float)
+        positions = (np.arange(POSITIONS) + 0.5) / POSITIONS
+        # probability of each count of capped rooms, and the pending rooms weighted by it
+        pi = np.zeros(len(kappa))
+        pending = np.zeros((len(kappa), n))
+        probs, children, _, _ = self.start
+        for prob, child in zip(probs, children):
+            state = np.ravel_multi_index(np.minimum(child[capped], caps).astype(int), shape)
+            pi[state] += prob
+            pending[state] += prob * child
+        # a run that goes on has reached the caps, only the rooms without cap are rewritten
+        stationary = np.ones(n)
+        stationary[capped] = 0
+        rows = []
+        while len(rows) < GENERATIONS:
+            total = pending.sum(0)
+            if total.sum() < EPSILON:
+                return np.array(rows or [np.ones(n)]), None
+            weight = np.where(pi > 0, pi, 1)[:, None]
+            rewrite = np.ones(pending.shape)
+            expected = (pending @ self.mean)[:, capped] / weight
+            rewrite[:, capped] = _below(positions[:, None, None] * expected, left).mean(0)
+            # done once no pending room leads to a capped room that is still below its cap
+            if (pending * ((left > 0).astype(float) @ feeds)).sum() < EPSILON:
+                break
+            rewritten = pending * rewrite
+            rows.append(np.where(total > EPSILON, rewritten.sum(0) / np.maximum(total, EPSILON), 1))
+            created = rewritten @ self.mean
+            expected = created[:, capped] / weight
+            steps = [
+                _transition(expected[:, axis], kappa[:, axis], caps[axis])
+                for axis in range(len(capped))
+            ]
+            joint = _joint([step[0] for step in steps], shape)
+            next_pending = joint.T @ created
+            for axis, idx in enumerate(capped):
+                factors = [step[0] for step in steps]
+                factors[axis] = steps[axis][1]
+                next_pending[:, idx] = _joint(factors, shape).T @ pi
+            pi = pi @ joint
+            pending = next_pending
+        return np.array(rows or [stationary]), stationary
+
+    def moments(self, thinning=None):
+        """Expected number and variance of the rooms of each class
+
+        Without maxnodes and maxiter, so the moments of the rooms created downstream of a
+        divergent group are infinite.
+
+        Returns:
+            tuple with the arrays of the means and the variances, indexed like classes
+        """
+        rows, repeat = thinning if thinning is not None else self.thinning()
+        k = len(self.classes)
+        n = len(self.symbols)
+        if repeat is None:
+            mean = np.zeros((n, k))
+            var = np.zeros((n, k))
+            inf = np.zeros((n, k), dtype=bool)
+        else:
+            mean, var, inf = self.__stationary(repeat)
+        for row in rows[::-1]:
+            mean, var, inf = self.__generation(row, mean, var, inf)
+        probs, children, rooms, _ = self.start
+        mean, var, inf = _combine(probs, children, rooms, mean, var, inf)
+        mean[inf] = math.inf
+        var[inf] = math.inf
+        return mean, var
+
+    def distributions(self, thinning=None, support=SUPPORT):
+        """Distributions of the number of rewrites and of vertices
+
+        The probability generating functions are evaluated on a circle of radius just below
+        1 and the probabilities are recovered with an FFT. Runs that rewrite more than
+        support rooms or outlive the followed generations fall in the tails.
+
+        Returns:
+            tuple with the arrays of the probabilities of 0..support-1 rewrites and
+            vertices, the vertices are None if a rewrite can remove vertices
+        """
+        rows, repeat = thinning if thinning is not None else self.thinning()
+        size = 1 << (2 * support - 1).bit_length()
+        radius = EPSILON ** (1 / size)
+        z = radius * np.exp(2j * np.pi * np.arange(size) / size)
+        generations = list(rows)
+        if repeat is not None:
+            generations.extend([repeat] * max(0, support - len(rows)))
+        rewrites = self.__pgf(generations, z, True)
+        vertices = None
+        if min(min(vtx) for _, _, _, vtx in self.rules + [self.start]) >= 0:
+            vertices = self.__pgf(generations, z, False)
+        scale = radius ** -np.arange(support)
+        rewrites = np.clip((np.fft.fft(rewrites) / size).real[:support] * scale, 0, 1)
+        if vertices is not None:
+            vertices = np.clip((np.fft.fft(vertices) / size).real[:support] * scale, 0, 1)
+        return rewrites, vertices
+
+    def estimate(self, maxnodes, maxiter, tolerance=TOLERANCE, support=SUPPORT):
+        """Estimates the generation of the grammar with the limits
+
+        The limits above support are taken as support, so their probability of being
+        reached is an upper bound.
+
+        Returns:
+            JSON serializable dict with the divergent groups of rules, the mean, the
+            probability of hitting the limit and the suggested budget of the iterations and
+            the vertices, and the mean and standard deviation of the rooms of each class
+            (None when infinite)
+        """
+        thinning = self.thinning()
+        mean, var = self.moments(thinning)
+        rewrites, vertices = self.distributions(thinning, support)
+        # the iteration that finds no room left is counted too
+        iterations = _limited(rewrites, maxiter, tolerance, 1)
+        return {
+            "grammar": self.grammar,
+            "maxnodes": maxnodes,
+            "maxiter": maxiter,
+            "divergent": self.divergent(),
+            "iterations": iterations,
+            "vertices": _limited(vertices, maxnodes, tolerance) if vertices is not None else None,
+            "rooms": {
+                name: {
+                    "mean": _finite(mean[idx]),
+                    "std": _finite(math.sqrt(max(var[idx], 0.0))),
+                }
+                for idx, name in enumerate(self.classes)
+            },
+        }
+
+    def __arrays(self, outcomes):
+        """Returns the probabilities, children, rooms and vertices of outcomes as arrays"""
+        children = np.zeros((len(outcomes), len(self.symbols)))
+        rooms = np.zeros((len(outcomes), len(self.classes)))
+        for idx, outcome in enumerate(outcomes):
+            for symbol, count in outcome.children.items():
+                children[idx, self._symbols[symbol]] = count
+            for name, count in outcome.rooms.items():
+                rooms[idx, self._classes[name]] = count
+        probs = np.array([outcome.prob for outcome in outcomes])
+        vertices = np.array([outcome.vertices for outcome in outcomes])
+        return probs, children, rooms, vertices
+
+    def __generation(self, row, mean, var, inf):
+        """Moments of the rooms created from a room of each type rewritten with thinning row"""
+        result = [_combine(*self.rules[idx][:3], mean, var, inf) for idx in range(len(row))]
+        next_mean = np.array([res[0] for res in result]) * row[:, None]
+        second = np.array([res[1] + res[0] ** 2 for res in result]) * row[:, None]
+        next_inf = np.array([res[2] for res in result]) & (row > 0)[:, None]
+        return next_mean, second - next_mean**2, next_inf
+
+    def __stationary(self, row):
+        """Moments of the rooms created from a room of each type once the thinning is row"""
+        n = len(self.symbols)
+        k = len(self.classes)
+        matrix = self.mean * row[:, None]
+        reach = _closure(matrix > 0)
+        produces = reach @ (self.rooms * row[:, None] > 0)
+        inf = np.zeros((n, k), dtype=bool)
+        for group in _components(matrix > 0):
+            if _radius(matrix[np.ix_(group, group)]) >= 1 - EPSILON:
+                inf |= reach[:, group].any(1)[:, None] & produces[group].any(0)
+        mean = np.zeros((n, k))
+        var = np.zeros((n, k))
+        for col in range(k):
+            free = np.flatnonzero(produces[:, col] & ~inf[:, col])
+            if not len(free):
+                continue
+            system = np.eye(len(free)) - matrix[np.ix_(free, free)]
+            mean[free, col] = np.linalg.solve(system, (self.rooms[:, col] * row)[free])
+        for idx in range(n):
+            probs, children, rooms, _ = self.rules[idx]
+            means = rooms + children @ np.where(inf, 0, mean)
+            var[idx] = row[idx] * (probs @ means**2) - mean[idx] ** 2
+        for col in range(k):
+            free = np.flatnonzero(produces[:, col] & ~inf[:, col])
+            if len(free):
+                system = np.eye(len(free)) - matrix[np.ix_(free, free)]
+                var[free, col] = np.linalg.solve(system, var[free, col])
+        return mean, var, inf
+
+    def __pgf(self, generations, z, rewrites):
+        """Generating function of the rewrites (or the vertices) of a generation, on z"""
+        n = len(self.symbols)
+        value = np.zeros((n, len(z)), dtype=complex)
+        for row in generations[::-1]:
+            value = np.array(
+                [_offspring(self.rules[idx], value, z, not rewrites, row[idx]) for idx in range(n)]
+            )
+            if rewrites:
+                value *= z
+        return _offspring(self.start, value, z, not rewrites, 1.0)
+
+
+def estimate(grammar, maxnodes=300, maxiter=200, tolerance=TOLERANCE, support=SUPPORT):
+    """Estimates the generation of a grammar from its production probabilities
+
+    Arguments:
+        grammar str: Grammar name, a key of utils.batch.GRAMMARS
+        maxnodes int: Vertex limit of the Dungeon
+        maxiter int: Iteration limit of the Dungeon
+        tolerance float: Probability of hitting a limit accepted by the suggested budgets
+        support int: Largest iteration or vertex count whose probability is computed
+
+    Returns:
+        dict, see GrammarModel.estimate
+    """
+    result = GrammarModel(get_grammar(grammar)).estimate(maxnodes, maxiter, tolerance, support)
+    result["grammar"] = grammar
+    return result
+
+
+def rewrite(cls, symbol, roll):
+    """Runs the rewrite of a room of the symbol, or the start if None, with a d100 roll
+
+    The rewrite is made on a scratch counting dungeon (see utils.simulation), which already
+    has the objects of a short generation. The objects of the rewritten room are named
+    <object>.
+
+    Returns:
+        Outcome of probability 1
+    """
+    dungeon = counting(cls)(seed=1, maxiter=1)
+    dungeon._pending.clear()
+    vertices = dungeon._g.vcount()
+    if symbol is None:
+        vertices -= 2
+    else:
+        obj = dungeon._add_object_dungeon("object", "<object>")
+        rv = dungeon._g.add_vertex()
+        dungeon._format_nv(rv, symbol, color_red, object=obj)
+        rv["reviewed"] = True
+        vertices += 1
+    dungeon._rooms = {}
+    rolls = len(dungeon._rolls)
+    dungeon._irolls = [roll]
+    if symbol is None:
+        dungeon._dungeonstart()
+    else:
+        dungeon._rv_processor(rv)
+    if len(dungeon._rolls) - rolls > 1:
+        raise ValueError(f"{cls.__name__}: {symbol or 'start'} rolls more than one d100")
+    children = Counter(dungeon._g.vs[vid]["type"] for vid in dungeon._pending)
+    rooms = Counter()
+    for type, count in dungeon._rooms.items():
+        rooms[room_class(type)] += count
+    return Outcome(1.0, dict(children), dict(rooms), dungeon._g.vcount() - vertices)
+
+
+def _enumerate(cls, symbol):
+    """Runs the rewrite of a room of the symbol, or the start if None, for each face"""
+    counts = Counter()
+    for roll in range(1, FACES + 1):
+        outcome = rewrite(cls, symbol, roll)
+        key = (
+            tuple(sorted(outcome.children.items())),
+            tuple(sorted(outcome.rooms.items())),
+            outcome.vertices,
+        )
+        counts[key] += 1
+    return [
+        Outcome(count / FACES, dict(children), dict(rooms), vertices)
+        for (children, rooms, vertices), count in counts.items()
+    ]
+
+
+def _cap(rule):
+    return rule.cap if rule is not None and rule.cap is not None else math.inf
+
+
+def _combine(probs, children, rooms, mean, var, inf):
+    """Mean, variance and infinite flags of the rooms created by a rewrite and its subtrees"""
+    means = rooms + children @ np.where(inf, 0, mean)
+    variances = children @ np.where(inf, 0, var)
+    total = probs @ means
+    return (
+        total,
+        probs @ (variances + means**2) - total**2,
+        ((children[probs > 0] > 0).astype(int) @ inf.astype(int)).any(0),
+    )
+
+
+def _offspring(arrays, value, z, vertices, rewrite):
+    """Generating function of a rewrite with its subtrees, given the ones of the children"""
+    probs, children, _, deltas = arrays
+    total = np.zeros(len(z), dtype=complex)
+    for prob, child, delta in zip(probs, children, deltas):
+        term = np.full(len(z), prob, dtype=complex)
+        if vertices and delta:
+            term *= z**delta
+        for idx in np.flatnonzero(child):
+            term *= value[idx] ** int(child[idx])
+        total += term
+    return (1 - rewrite) + rewrite * total
+
+
+def _below(expected, left):
+    """Probability that a Poisson count of the expected mean is below left"""
+    expected = np.broadcast_to(expected, np.broadcast_shapes(expected.shape, left.shape))
+    result = np.zeros(expected.shape)
+    term = np.exp(-expected)
+    for count in range(int(left.max(initial=0))):
+        result += np.where(count < left, term, 0)
+        term = term * expected / (count + 1)
+    return result
+
+
+def _transition(expected, current, cap):
+    """Distribution of the capped count after a Poisson number of new rooms
+
+    Returns:
+        tuple with the probability of each count, and the expected new rooms times it
+    """
+    probs = np.zeros((len(current), cap + 1))
+    counts = np.zeros((len(current), cap + 1))
+    rows = np.arange(len(current))
+    term = np.exp(-expected)
+    below = np.zeros(len(current))
+    below_counts = np.zeros(len(current))
+    for count in range(cap):
+        ok = current + count < cap
+        target = np.minimum(current + count, cap)
+        probs[rows[ok], target[ok]] += term[ok]
+        counts[rows[ok], target[ok]] += count * term[ok]
+        below += np.where(ok, term, 0)
+        below_counts += np.where(ok, count * term, 0)
+        term = term * expected / (count + 1)
+    probs[:, cap] += np.maximum(1 - below, 0)
+    counts[:, cap] += np.maximum(expected - below_counts, 0)
+    return probs, counts
+
+
+def _joint(factors, shape):
+    """Transition matrix between states from independent transitions of each capped count"""
+    states = factors[0].shape[0]
+    joint = np.ones((states,) + shape)
+    for axis, factor in enumerate(factors):
+        view = [states] + [1] * len(shape)
+        view[axis + 1] = shape[axis]
+        joint = joint * factor.reshape(view)
+    return joint.reshape(states, -1)
+
+
+def _closure(adjacency):
+    """Reachability matrix of a graph, every vertex reaches itself"""
+    reach = adjacency | np.eye(len(adjacency), dtype=bool)
+    while True:
+        step = (reach.astype(int) @ reach.astype(int)) > 0
+        if (step == reach).all():
+            return reach
+        reach = step
+
+
+def _components(adjacency):
+    """Strongly connected components of a graph with at least one edge inside"""
+    reach = _closure(adjacency)
+    mutual = reach & reach.T
+    seen = set()
+    groups = []
+    for idx in range(len(adjacency)):
+        if idx in seen:
+            continue
+        group = list(np.flatnonzero(mutual[idx]))
+        seen.update(group)
+        if len(group) > 1 or adjacency[idx, idx]:
+            groups.append(group)
+    return groups
+
+
+def _radius(matrix):
+    return float(np.abs(np.linalg.eigvals(matrix)).max())
+
+
+def _limited(probs, limit, tolerance, offset=0):
+    """Mean, probability of reaching the limit and budget of a count with probs
+
+    Arguments:
+        probs ndarray: Probability of each value of the count without limit
+        limit int: The generation stops when the count reaches it
+        tolerance float: Probability of reaching the budget accepted
+        offset int: Added to the count
+    """
+    limit = min(limit, len(probs))
+    below = probs[:limit]
+    reached = max(1 - below.sum(), 0.0)
+    # the limit is reached by the counts from limit on, the smallest limit reached with at
+    # most tolerance probability is the budget
+    budget = np.flatnonzero(1 - np.cumsum(probs) <= tolerance)
+    return {
+        "mean": float((np.arange(len(below)) + offset) @ below + reached * limit),
+        "limit": float(reached),
+        "budget": int(budget[0] + 1) if len(budget) else None,
+    }
+
+
+def _finite(value):
+    return float(value) if math.isfinite(value) else None
@@ -0,0 +1,38 @@
+import json
+
+
+def to_json(dungeon):
+    """Returns the dungeon as a JSON document, see Dungeon.to_dict"""
+    return json.dumps(dungeon.to_dict(), separators=(",", ":"))
+
+
+def to_edgelist(dungeon):
+    """Returns one "source target" line per edge, vertices numbered like in to_dict"""
+    return "\n".join(f"{s} {d}" for s, d in dungeon.to_dict()["edges"])
+
+
+def to_dot(dungeon):
+    """Returns the dungeon as a Graphviz digraph with the room names and colors"""
+    data = dungeon.to_dict()
+    lines = [f"digraph {_quote(data['grammar'] + '_' + str(data['seed']))} {{"]
+    lines.append("    node [shape=box, style=filled];")
+    for idx, vertex in enumerate(data["vertices"]):
+        lines.append(
+            f"    {idx} [label={_quote(vertex['name'])}, fillcolor={_quote(vertex['color'])}];"
+        )
+    for s, d in data["edges"]:
+        lines.append(f"    {s} -> {d};")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+EXPORTERS = {
+    "json": to_json,
+    "edgelist": to_edgelist,
+    "dot": to_dot,
+}
+
+
+def _quote(value):
+    """Returns a double quoted DOT string"""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
@@ -0,0 +1,75 @@
+from bisect import bisect_left
+
+
+class Rule:
+    """Rewriting rule of a grammar
+
+    Arguments:
+        symbol str: Room type rewritten by the rule
+        fragment str: Name of the Dungeon method that replaces the room with its fragment
+        productions tuple: (weight, value) pairs. The weights are d100 points and must add
+            up to 100. The rule rolls a d100 to choose a production and calls the fragment
+            with the vertex and the chosen value. Without productions the fragment is called
+            with the vertex only and no roll is made
+        cap int: Once this many rooms of the type exist the rule is no longer applied
+    """
+
+    def __init__(self, symbol, fragment, productions=None, cap=None):
+        self.symbol = symbol
+        self.fragment = fragment
+        self.productions = productions
+        self.cap = cap
+
+    def __repr__(self):
+        return f"Rule({self.symbol}, {self.fragment}, {self.productions}, cap={self.cap})"
+
+
+class CompiledRule:
+    """Dispatch table entry of a rule
+
+    thresholds holds the cumulative d100 thresholds of the productions, so the chosen
+    production is the first one whose threshold is not below the roll.
+    """
+
+    __slots__ = ("rid", "symbol", "func", "cap", "thresholds", "values")
+
+    def __init__(self, rid, symbol, func, cap, thresholds, values):
+        self.rid = rid
+        self.symbol = symbol
+        self.func = func
+        self.cap = cap
+        self.thresholds = thresholds
+        self.values = values
+
+    def choose(self, roll):
+        """Returns the index of the production for a d100 roll"""
+        return bisect_left(self.thresholds, roll)
+
+
+def compile_grammar(cls):
+    """Compiles the GRAMMAR rules of a Dungeon class into a dispatch table
+
+    Returns:
+        dict: room type -> CompiledRule, rule ids are numbered from 1 in declaration order
+    """
+    table = {}
+    for rid, rule in enumerate(cls.GRAMMAR, 1):
+        if rule.symbol in table:
+            raise ValueError(f"{cls.__name__}: duplicated rule for {rule.symbol}")
+        func = getattr(cls, rule.fragment, None)
+        if not callable(func):
+            raise ValueError(f"{cls.__name__}: missing fragment {rule.fragment} for {rule.symbol}")
+        thresholds = values = None
+        if rule.productions:
+            thresholds = []
+            values = []
+            total = 0
+            for weight, value in rule.productions:
+                total += weight
+                thresholds.append(total)
+                values.append(value)
+            if total != 100:
+                raise ValueError(f"{cls.__name__}: weights for {rule.symbol} add up to {total}")
+            values = tuple(values)
+        table[rule.symbol] = CompiledRule(rid, rule.symbol, func, rule.cap, thresholds, values)
+    return table
@@ -1,10 +1,16 @@
+import heapq
 import logging
 import random
+import time
 from abc import ABC, abstractmethod
+from collections import deque
 
-import igraph
-
-from utils.string_utils import random_string
+from utils.array_graph import ArrayGraph
+from utils.dice_roller import DiceRoller
+from utils.grammar import compile_grammar
+from utils.profiling import GenerationStats, instrument
+from utils.string_utils import UidGenerator, random_string
+from utils.trace import Trace
 
 from utils.color_utils import (
     color_green,
@@ -13,65 +19,128 @@ from utils.color_utils import (
     color_yellow,
 )
 
-logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
+
 logging.getLogger("matplotlib").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 MAXNODE = 300
 MAXITER = 200
+# rewrites, or rooms visited by the reduction, between two checks of the deadline and memory
+CHECK_EVERY = 16
+
+
+def setup_logging(debug=False):
+    """Sets the logging format for the CLI scripts, at DEBUG level with debug"""
+    logging.basicConfig(
+        format=LOG_FORMAT, datefmt=LOG_DATEFMT, level=logging.DEBUG if debug else logging.WARNING
+    )
 
 
 class Dungeon(ABC):
+    # Rules of the grammar, compiled once per class into _rules
+    GRAMMAR = ()
+    _rules = {}
+    _rules_by_id = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "GRAMMAR" in cls.__dict__:
+            cls._rules = compile_grammar(cls)
+            cls._rules_by_id = {rule.rid: rule for rule in cls._rules.values()}
+
     def __init__(self, **dargs):
+        self.__init_dungeon(dargs)
+
+        try:
+            self.generate()
+        except Exception as e:
+            self.logger.fatal("Error in dungeon generation")
+            self._get_process_info()
+            raise e
+        return
+
+    def __init_dungeon(self, dargs, rolls=True):
+        """Initializes the dungeon state from the constructor arguments
+
+        Arguments:
+            dargs dict: Constructor arguments
+            rolls bool: Fill the rolls pool, not needed for an already generated dungeon
+        """
         maxiter = dargs.get("maxiter", MAXITER)
         maxnodes = dargs.get("maxnodes", MAXNODE)
         seed = dargs.get("seed")
         self._debug = dargs.get("debug")
         self._reduce = dargs.get("reduce", True)
         self._show_graph = dargs.get("show_graph")
+        # milliseconds and bytes the generation may take
+        self._deadline_ms = dargs.get("deadline")
+        self._maxmemory = dargs.get("maxmemory")
+        self._deadline = None
+        # limit that stopped the generation, see _process
+        self.status = None
+        self._capture = None
+        if dargs.get("animate"):
+            from utils.animation import AnimationCapture
+
+            self._capture = AnimationCapture(dargs["animate"])
 
         self._runid = random_string(8)
+        self._random = random.Random()
+        self.dice = DiceRoller(self._random)
         self.__init_graph()
-        self.__init_limits(seed, maxnodes, maxiter)
+        self.__init_limits(seed, maxnodes, maxiter, rolls)
+        self._trace = Trace(self._seed, maxnodes, maxiter, self._reduce)
+        self._rolls = self._trace.stream
         self.logger = logger
-
-        try:
-            self.generate()
-        except Exception as e:
-            self.logger.fatal("Error in dungeon generation")
-            self._get_process_info()
-            raise e
-        return
-
-    def __init_limits(self, seed, maxnode, maxiter):
-        if not seed:
+        self._budget = None
+        if dargs.get("budget"):
+            from utils.budget import Budget
+
+            self._budget = Budget(type(self), maxnodes, maxiter)
+        self.stats = None
+        if dargs.get("profile"):
+            self.stats = GenerationStats()
+            instrument(self, self.stats)
+
+    def __init_limits(self, seed, maxnode, maxiter, rolls=True):
+        if seed is None:
             seed = random.randint(1, 20000)
         else:
             seed = int(seed)
-        self.__fill_rolls(seed)
+        self._irolls = []
+        if rolls:
+            self.__fill_rolls(seed)
         self._niter = 0
         self._missing_gram = []
         self._maxnode = maxnode - 1
         self._maxiter = maxiter - 1
-        self._rolls = []
         self._seed = seed
+        self._uid = UidGenerator(seed)
 
     def __init_graph(self):
         """Initializes de Graph, Objects and Rooms"""
-        self._g = igraph.Graph(directed=True)
+        self._g = ArrayGraph(directed=True)
+        self._igraph = None
         self._objects = []
+        self._objects_by_type = {}
+        self._pending = deque()
         self._rooms = {}
         return
 
     def __fill_rolls(self, seed):
-        """Fills the rolls pool using the seed"""
-        random.seed(seed)
+        """Fills the rolls pool using the seed
+
+        The dungeon has its own random stream, so dungeons generated in parallel threads do
+        not change each other's rolls.
+        """
+        self._random.seed(seed)
         self._irolls = (
-            random.sample(range(1, 101), 50)
-            + random.sample(range(1, 101), 50)
-            + random.sample(range(1, 101), 50)
-            + random.sample(range(1, 101), 50)
+            self._random.sample(range(1, 101), 50)
+            + self._random.sample(range(1, 101), 50)
+            + self._random.sample(range(1, 101), 50)
+            + self._random.sample(range(1, 101), 50)
         )
         return
 
@@ -82,12 +151,14 @@ class Dungeon(ABC):
             roll = self._irolls.pop()
         except IndexError:
             self.__fill_rolls(self._seed + self._niter)
-            roll = self.d100
+            roll = self._irolls.pop()
         self._rolls.append(roll)
         return roll
 
     def generate(self):
         """Generates a new dungeon"""
+        if self._deadline_ms is not None:
+            self._deadline = time.perf_counter() + self._deadline_ms / 1000
         if len(self._g.vs) > 0:
             self.__init_graph()
         self._g.add_vertices(2)
@@ -98,6 +169,10 @@ class Dungeon(ABC):
         if self._reduce:
             self._red_cleanup()
             self._reduce_graph()
+        self._trace.status = self.status
+        if self._capture is not None:
+            self._capture.snapshot(self)
+            self._capture.close()
         if self._debug:
             self._get_process_info()
         if self._show_graph:
@@ -105,14 +180,174 @@ class Dungeon(ABC):
         return
 
     def get_graph(self):
-        """Returns the igraph object"""
-        return self._g
+        """Returns the igraph object, built from the generation graph on first use"""
+        if self._igraph is None:
+            self._igraph = self._g.to_igraph()
+        return self._igraph
+
+    def to_dict(self):
+        """Returns a JSON serializable dict with the dungeon
+
+        Vertices are numbered in creation order like in get_graph(), and the objects in a
+        room are referenced by uid.
+        """
+        vids = self._g.vertex_ids()
+        index = {vid: idx for idx, vid in enumerate(vids)}
+        vertices = []
+        for vid in vids:
+            vtx = self._g.vs[vid]
+            vertex = {
+                "type": vtx["type"],
+                "name": vtx["name"],
+                "color": vtx["color"],
+                "uid": vtx["uid"],
+            }
+            if vtx["objects"]:
+                vertex["objects"] = [obj.uid for obj in vtx["objects"]]
+            vertices.append(vertex)
+        return {
+            "grammar": type(self).__name__,
+            "seed": self._seed,
+            "maxnodes": self._maxnode + 1,
+            "maxiter": self._maxiter + 1,
+            "reduce": self._reduce,
+            "iterations": self._niter,
+            "status": self.status,
+            "rooms": dict(self._rooms),
+            "objects": [
+                {"type": obj.type, "name": obj.name, "uid": obj.uid} for obj in self._objects
+            ],
+            "vertices": vertices,
+            "edges": [(index[s], index[d]) for s, d in self._g.get_edgelist()],
+        }
+
+    def to_csr(self):
+        """Returns the graph as CSR arrays in a single NumPy buffer, see utils.csr.CSRGraph"""
+        from utils.csr import to_csr
+
+        return to_csr(self)
+
+    @classmethod
+    def from_dict(cls, data, trace=None):
+        """Rebuilds a dungeon from the output of to_dict() without generating it again
+
+        Arguments:
+            data dict: Output of to_dict()
+            trace Trace: Trace of the generation of the dungeon, without it the rebuilt
+                dungeon has no trace
+        """
+        dungeon = cls.__new__(cls)
+        dungeon.__init_dungeon(
+            {
+                "seed": data["seed"],
+                "maxnodes": data["maxnodes"],
+                "maxiter": data["maxiter"],
+                "reduce": data["reduce"],
+            },
+            rolls=False,
+        )
+        dungeon._niter = data["iterations"]
+        dungeon.status = data.get("status")
+        dungeon._rooms = dict(data["rooms"])
+        objects = {}
+        for obj in data["objects"]:
+            aod = dungeon.__dobject(obj["type"], obj["name"], obj["uid"])
+            dungeon._objects.append(aod)
+            dungeon._objects_by_type.setdefault(aod.type, []).append(aod)
+            objects[aod.uid] = aod
+        for vertex in data["vertices"]:
+            nv = dungeon._g.add_vertex()
+            nv["type"] = vertex["type"]
+            nv["color"] = vertex["color"]
+            nv["name"] = vertex["name"]
+            nv["reviewed"] = False
+            nv["uid"] = vertex["uid"]
+            if vertex.get("objects"):
+                nv["objects"] = [objects[uid] for uid in vertex["objects"]]
+        dungeon._g.add_edges(data["edges"])
+        dungeon._trace = trace
+        if trace is not None:
+            dungeon._rolls = trace.stream
+        return dungeon
+
+    @property
+    def trace(self):
+        """Trace of the rewrites of the generation, see utils.trace, None for a dungeon rebuilt
+        by from_dict without it"""
+        return self._trace
+
+    @classmethod
+    def replay(cls, trace):
+        """Rebuilds a dungeon from its trace
+
+        The rewrites are applied to the recorded vertices in order with the recorded rolls, so
+        the rule selection, the caps and the worklist are not evaluated again. Vertex ids and
+        uids are given in creation order, which makes them match the ones of the generation.
+        A reduction cut short by the deadline stops after the rooms it visited.
+
+        Raises:
+            ValueError if the grammar does not consume the recorded rolls
+        """
+        dungeon = cls.__new__(cls)
+        dungeon.__init_dungeon(
+            {
+                "seed": trace.seed,
+                "maxnodes": trace.maxnodes,
+                "maxiter": trace.maxiter,
+                "reduce": trace.reduce,
+            },
+            rolls=False,
+        )
+        # d100 pops the rolls from the end of the pool
+        dungeon._irolls = trace.stream.tolist()
+        dungeon._irolls.reverse()
+        g = dungeon._g
+        g.add_vertices(2)
+        dungeon._format_nv(g.vs[0], "st", color_yellow, "START")
+        dungeon._format_nv(g.vs[1], "gl", color_orange, "GOAL")
+        dungeon._dungeonstart()
+        rules = cls._rules_by_id
+        for rid, vid, roll in trace:
+            rv = g.vs[vid]
+            rv["reviewed"] = True
+            if rid == 0:
+                dungeon._terminate_room(rv)
+                continue
+            rule = rules[rid]
+            if rule.thresholds is None:
+                rule.func(dungeon, rv)
+                continue
+            if dungeon.d100 != roll:
+                raise ValueError(
+                    f"Trace rewrite of {vid} does not match the {cls.__name__} grammar"
+                )
+            rule.func(dungeon, rv, rule.values[rule.choose(roll)])
+        if dungeon._rolls != trace.stream:
+            raise ValueError(f"Trace rolls do not match the {cls.__name__} grammar")
+        dungeon._pending.clear()
+        dungeon._niter = trace.iterations
+        dungeon._trace = trace
+        dungeon._rolls = trace.stream
+        if dungeon._reduce:
+            dungeon._red_cleanup()
+            dungeon._reduce_graph(trace.reduced)
+        dungeon.status = trace.status
+        return dungeon
 
     def plot_dungeon(self, glayout="fr", debug=False):
-        """Plots the dungeon graph"""
+        """Plots the dungeon graph
+
+        With debug the graph is written to debug/img by the headless renderer instead
+        """
+        if debug:
+            from utils.render import render_dungeon
+
+            filename = f"debug/img/{self._runid}_{self._niter:04}.png"
+            return render_dungeon(self, filename, layout=glayout)
+
+        import igraph
         import matplotlib.pyplot as plt
 
-        filename = f"debug/img/{self._runid}_{self._niter:04}.png"
         plt.title = f"Iter: {self._niter:04}"
 
         #  glayout = "davidson_harel"
@@ -122,7 +357,8 @@ class Dungeon(ABC):
         #  glayout = "kk"
         #  glayout = "lgl"
         #  glayout = "fr"
-        layout = self._g.layout(layout=glayout)
+        graph = self._g.to_igraph()
+        layout = graph.layout(layout=glayout)
 
         fig, ax = plt.subplots()
 
@@ -131,22 +367,17 @@ class Dungeon(ABC):
         visual_style["bbox"] = (300, 300)
         visual_style["margin"] = 20
 
-        if debug:
-            visual_style["target"] = filename
-        else:
-            visual_style["target"] = ax
-        visual_style["vertex_label"] = self._g.vs["name"]
+        visual_style["target"] = ax
+        visual_style["vertex_label"] = graph.vs["name"]
         visual_style["vertex_label_size"] = 15
         visual_style["vertex_label_dist"] = 10
-        visual_style["vertex_color"] = self._g.vs["color"]
+        visual_style["vertex_color"] = graph.vs["color"]
         visual_style["vertex_shape"] = "rectangle"
         visual_style["vertex_size"] = 12
 
-        igraph.plot(self._g, **visual_style)
-        if not debug:
-            plt.show()
-        else:
-            plt.close()
+        igraph.plot(graph, **visual_style)
+        plt.show()
+        plt.close(fig)
 
     def get_objects(self):
         """Returns a str with the objects in the dungeon"""
@@ -157,8 +388,9 @@ class Dungeon(ABC):
         """Adds an objet to the dungeon"""
         if not name:
             name = type
-        aod = self.__dobject(type, name)
+        aod = self.__dobject(type, name, self._uid())
         self._objects.append(aod)
+        self._objects_by_type.setdefault(type, []).append(aod)
         return aod
 
     def _count_room(self, type):
@@ -184,14 +416,10 @@ class Dungeon(ABC):
             name str: Name of the vertex (defaults to type)
             object dobject: Object of the vertex
         """
-        nv["type"] = type
-        nv["color"] = color
         if not name:
             name = type
         #  nv["name"] = f"{name} - {nv.index}"
-        nv["name"] = name
-        nv["reviewed"] = False
-        nv["uid"] = random_string(8)
+        self._g.set_vertex(nv.index, type, color, name, False, self._uid())
         debugstr = f"Node {nv.index}\ntype: {type}\ncolor: {color}\nname: {name}"
         if object:
             nv["objects"] = [object]
@@ -199,17 +427,24 @@ class Dungeon(ABC):
         #  self.logger.debug(debugstr)
         return
 
+    def _exhausted(self):
+        """Returns the limit that has run out, deadline or maxmemory, None if none has"""
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            return "deadline"
+        if self._maxmemory is not None and self._g.memory() > self._maxmemory:
+            return "maxmemory"
+        return None
+
     def _get_dungeon_object_type(self, type, oidx=0):
         """Given a type return the first object in the Dungeon"""
-        lobjs = [oobj for oobj in self._objects if oobj.type == type]
-        if len(lobjs) == 0:
+        lobjs = self._objects_by_type.get(type)
+        if not lobjs:
             return None
         return lobjs[oidx]
 
     def _get_object_type_count(self, type):
         """Given a type return the number of objects of the type in the Dungeon"""
-        lobjs = [oobj for oobj in self._objects if oobj.type == type]
-        return len(lobjs)
+        return len(self._objects_by_type.get(type, ()))
 
     def _get_object_vertex(self, vtx, type=None, oidx=0):
         """Retrieve an object from the vertex based on the object index
@@ -243,9 +478,12 @@ class Dungeon(ABC):
             for miss in self._missing_gram:
                 self.logger.error(f">>>>>>>>>>>>>> MISSING: {miss}")
         self.logger.debug(f"Rolls: {len(self._rolls)}")
-        self.logger.debug(f"Rolls: {self._rolls}")
+        self.logger.debug(f"Rolls: {list(self._rolls)}")
         self.logger.debug(f"Iterations: {self._niter}")
+        self.logger.debug(f"Status: {self.status}")
         self.logger.debug(f"Vertices: {self._g.vcount()}")
+        if self._budget is not None:
+            self.logger.debug(f"Budget forced rewrites: {self._budget.forced}")
         self.logger.debug(f"Rooms: {self._rooms}")
         self.logger.debug(f"Objects: {self.get_objects()}")
 
@@ -273,6 +511,8 @@ class Dungeon(ABC):
         self._format_nv(nv, type, color, name, object)
         self._g.add_edges([(voi, nv.index), (nv.index, vdi)])
         self._count_room(type)
+        if color == color_red:
+            self._pending.append(nv.index)
         return nv.index
 
     def _insert_room_end(self, vdi, type, name=None, object=None, color=color_red):
@@ -292,12 +532,70 @@ class Dungeon(ABC):
         self._format_nv(nv, type, color, name, object)
         self._g.add_edge(vdi, nv.index)
         self._count_room(type)
+        if color == color_red:
+            self._pending.append(nv.index)
         return nv.index
 
-    @abstractmethod
+    def _next_red_vertex(self):
+        """Pops the oldest pending red vertex from the worklist
+
+        Vertices are queued in creation order, which is also their id order, so the
+        vertex returned is the same one a scan for the first unreviewed red vertex finds.
+
+        Returns:
+            Vertex object or None when there is nothing left to process
+        """
+        while self._pending:
+            rv = self._g.vs[self._pending.popleft()]
+            if rv["color"] == color_red and rv["reviewed"] is False:
+                return rv
+        return None
+
     def _process(self):
-        """Needs to be implemented in the child class"""
-        pass
+        """Main graph processor
+
+        Substitutes every red vertex with a fragment of the rule for its type.
+
+        Finishes when there are no red vertices left, after maxiter iterations, if the
+        graph has more than maxnodes vertices or, checked every CHECK_EVERY rewrites, when
+        the deadline has passed or the graph takes more than maxmemory bytes. status is set
+        to complete or to the limit that stopped it. When the generation is being animated a
+        frame is captured before each rewrite.
+        """
+        missing_gram = set()
+        capture = self._capture
+        bounded = self._deadline is not None or self._maxmemory is not None
+        self.status = "complete"
+        while True:
+            self._niter += 1
+            if capture is not None:
+                capture.snapshot(self)
+            # get the next red vertex
+            rv = self._next_red_vertex()
+            if rv is None:
+                break
+            rv["reviewed"] = True
+            rtype = rv["type"]
+            status = self._rv_processor(rv)
+            if status is None:
+                missing_gram.add(rtype)
+            # max num of iter
+            if self._g.vcount() > self._maxnode:
+                self.status = "maxnodes"
+                break
+            if self._niter > self._maxiter:
+                self.status = "maxiter"
+                break
+            if bounded and self._niter % CHECK_EVERY == 0:
+                exhausted = self._exhausted()
+                if exhausted is not None:
+                    self.status = exhausted
+                    break
+        self._trace.iterations = self._niter
+        if missing_gram:
+            self._missing_gram = sorted(missing_gram)
+            self.logger.error(f"Missing grammar for {missing_gram}")
+        return
 
     def _red_cleanup(self):
         """Converts all the red nodes to n type"""
@@ -308,33 +606,65 @@ class Dungeon(ABC):
             self._format_nv(rv, "n", color_green)
         return
 
-    def _reduce_graph(self):
-        """Finds repeated (contiguous) elements of type e,n,p and simplifies them"""
+    def _reduce_graph(self, limit=None):
+        """Finds repeated (contiguous) elements of type e,n,p and simplifies them
+
+        For each type, the rooms preceded by a room of the same type are visited once in id
+        order and bypassed, so every run of rooms of the type collapses into its first room.
+        Bypassing a room only gives new in-neighbours to its out-neighbours, so those are the
+        only rooms queued again. The multiple edges left behind are removed at the end.
+
+        When the deadline passes the reduction stops, checked every CHECK_EVERY rooms, and
+        status is set to deadline. The dungeon is valid but only partly reduced. The rooms
+        visited are recorded in the trace, so a replay stops at the same room.
+
+        Arguments:
+            limit int: Rooms to visit before stopping, None to run to the end
+        """
         reduce_element_list = ["e", "n", "p"]
+        bounded = self._deadline is not None or self._maxmemory is not None
+        visited = 0
+        # a deadline passed during _process skips the reduction
+        stopped = self.status == "deadline"
         for re in reduce_element_list:
-            while True:
-                # set of elements of the type that connect with elements of the type
-                re_set = {
-                    ele
-                    for con in self._g.vs.select(type_eq=re, reviewed_eq=False)
-                    for ele in con.neighbors("out")
-                    if ele["type"] == re and ele["reviewed"] is False
-                }
-                if not re_set:
+            if stopped:
+                break
+            pending = [vtx.index for vtx in self._g.vs.select(type_eq=re, reviewed_eq=False)]
+            queued = set(pending)
+            while pending:
+                if visited == limit or (
+                    bounded and visited % CHECK_EVERY == 0 and self._exhausted() == "deadline"
+                ):
+                    stopped = True
                     break
-                # get a random element connected with another element of the same type
-                vs = re_set.pop()
+                visited += 1
+                vid = heapq.heappop(pending)
+                queued.discard(vid)
+                if vid not in self._g:
+                    continue
+                vs = self._g.vs[vid]
+                if vs["reviewed"] is not False:
+                    continue
+                # only elements connected with another element of the type
+                lin = vs.neighbors("in")
+                if not any(con["type"] == re and con["reviewed"] is False for con in lin):
+                    continue
                 vs["reviewed"] = True
-                try:
-                    # get edge that comes in
-                    ln = vs.neighbors("in")[0]
-                    fn = vs.neighbors("out")[0]
-                except IndexError:
+                lout = vs.neighbors("out")
+                if not lout:
                     continue
+                ln = lin[0]
+                fn = lout[0]
                 if len(set((vs, fn, ln))) < 3:
-                    self._g.simplify()
                     continue
                 self._remove_room(vs, fn, ln)
+                for ele in lout:
+                    if ele.index not in queued and ele["type"] == re:
+                        heapq.heappush(pending, ele.index)
+                        queued.add(ele.index)
+        if stopped:
+            self.status = "deadline"
+            self._trace.reduced = visited
         self._g.simplify()
 
     def _remove_room(self, rv, fn, ln=None):
@@ -382,13 +712,48 @@ class Dungeon(ABC):
         self._g.delete_vertices(rv)
         return
 
+    def _rv_processor(self, rv):
+        """Process the red vertex according to its type
+
+        With a budget the production may be the cheapest one instead of the rolled one, see
+        utils.budget.Budget.
+
+        Returns:
+            True if a rule was applied, None if there is no rule for the type or its cap
+            has been reached
+        """
+        budget = self._budget
+        if budget is not None:
+            budget.pop(self, rv)
+        rule = self._rules.get(rv["type"])
+        if rule is None or (rule.cap is not None and self._rooms.get(rule.symbol, 0) >= rule.cap):
+            self._trace.record(0, rv.index)
+            self._terminate_room(rv)
+            return None
+        if rule.thresholds is None:
+            self._trace.record(rule.rid, rv.index)
+            rule.func(self, rv)
+        else:
+            roll = self.d100
+            if budget is not None:
+                roll = budget.choose(self, rule, roll)
+            self._trace.record(rule.rid, rv.index, roll)
+            rule.func(self, rv, rule.values[rule.choose(roll)])
+        return True
+
+    def _terminate_room(self, rv):
+        """Turns a red vertex that no rule can rewrite into an n room"""
+        self._format_nv(rv, "n", color_green)
+
     class __dobject:
         """Subclass to store objects"""
 
-        def __init__(self, type, name):
+        __slots__ = ("type", "name", "uid")
+
+        def __init__(self, type, name, uid):
             self.type = type
             self.name = name
-            self.uid = random_string(8)
+            self.uid = uid
 
         def __repr__(self):
             return f"Type: {self.type} :: Name: {self.name} :: {self.uid}"
@@ -0,0 +1,142 @@
+from time import perf_counter
+
+# Graph primitives of the Dungeon timed when profiling
+PRIMITIVES = ("_insert_room_btw", "_insert_room_end", "_remove_room")
+
+
+class RuleStats:
+    """Counters of the applications of a rule
+
+    Times include the graph primitives called by the fragment. Rooms whose type has no rule,
+    or whose rule reached its cap, are counted as terminated.
+    """
+
+    __slots__ = (
+        "symbol",
+        "calls",
+        "terminated",
+        "time",
+        "vertices_added",
+        "vertices_removed",
+        "edges_added",
+        "edges_removed",
+        "rolls",
+    )
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.calls = 0
+        self.terminated = 0
+        self.time = 0.0
+        self.vertices_added = 0
+        self.vertices_removed = 0
+        self.edges_added = 0
+        self.edges_removed = 0
+        self.rolls = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class PrimitiveStats:
+    """Counters of the calls to a graph primitive"""
+
+    __slots__ = ("name", "calls", "time")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.time = 0.0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class GenerationStats:
+    """Profile of the generation of a dungeon
+
+    Filled by the wrappers that instrument() installs on a Dungeon created with
+    profile=True, and available as Dungeon.stats.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.primitives = {name: PrimitiveStats(name) for name in PRIMITIVES}
+
+    def rule(self, symbol):
+        """Returns the counters of the rule for a room type"""
+        stats = self.rules.get(symbol)
+        if stats is None:
+            stats = self.rules[symbol] = RuleStats(symbol)
+        return stats
+
+    def as_dict(self):
+        """Returns a JSON serializable dict with the counters"""
+        return {
+            "rules": {symbol: stats.as_dict() for symbol, stats in self.rules.items()},
+            "primitives": {name: stats.as_dict() for name, stats in self.primitives.items()},
+        }
+
+    def report(self):
+        """Returns a table with the counters, slowest rules first"""
+        lines = [
+            f"{'rule':8} {'calls':>7} {'term':>5} {'time ms':>9} {'v+':>6} {'v-':>6} "
+            f"{'e+':>6} {'e-':>6} {'rolls':>6}"
+        ]
+        for stats in sorted(self.rules.values(), key=lambda stats: -stats.time):
+            lines.append(
+                f"{stats.symbol:8} {stats.calls:>7} {stats.terminated:>5} "
+                f"{stats.time * 1000:9.3f} {stats.vertices_added:>6} {stats.vertices_removed:>6} "
+                f"{stats.edges_added:>6} {stats.edges_removed:>6} {stats.rolls:>6}"
+            )
+        lines.append(f"{'primitive':18} {'calls':>7} {'time ms':>9}")
+        for stats in self.primitives.values():
+            lines.append(f"{stats.name:18} {stats.calls:>7} {stats.time * 1000:9.3f}")
+        return "\n".join(lines)
+
+
+def instrument(dungeon, stats):
+    """Wraps the rule processor and the graph primitives of a dungeon to fill stats
+
+    The wrappers are set on the instance, so dungeons created without profiling keep
+    calling the plain methods.
+    """
+    rv_processor = dungeon._rv_processor
+
+    def profiled_rv_processor(rv):
+        graph = dungeon._g
+        rule = stats.rule(rv["type"])
+        vadded, vdeleted = graph._vadded, graph._vdeleted
+        eadded, edeleted = graph._eadded, graph._edeleted
+        rolls = len(dungeon._rolls)
+        start = perf_counter()
+        status = rv_processor(rv)
+        rule.time += perf_counter() - start
+        rule.calls += 1
+        if status is None:
+            rule.terminated += 1
+        graph = dungeon._g
+        rule.vertices_added += graph._vadded - vadded
+        rule.vertices_removed += graph._vdeleted - vdeleted
+        rule.edges_added += graph._eadded - eadded
+        rule.edges_removed += graph._edeleted - edeleted
+        rule.rolls += len(dungeon._rolls) - rolls
+        return status
+
+    dungeon._rv_processor = profiled_rv_processor
+    for name in PRIMITIVES:
+        setattr(dungeon, name, _timed(getattr(dungeon, name), stats.primitives[name]))
+
+
+def _timed(method, stats):
+    """Wraps a bound method to count its calls and time"""
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats.time += perf_counter() - start
+            stats.calls += 1
+
+    return wrapper
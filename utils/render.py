@@ -0,0 +1,208 @@
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.batch import CHUNKSIZE, generate_batch
+
+FORMATS = ("png", "svg")
+
+_local = threading.local()
+
+
+def render_dict(data, path, fmt=None, layout="fr", size=(300, 300), dpi=100, labels=True):
+    """Renders a dungeon from the output of Dungeon.to_dict() to an image file
+
+    Uses a Figure on the Agg canvas instead of pyplot, so it works without a display and no
+    figure is left open. The figure is kept and reused by the next render in the thread.
+
+    Arguments:
+        data dict: Output of Dungeon.to_dict()
+        path str: Image file to write
+        fmt str: Image format, png or svg (defaults to the path extension)
+        layout str: igraph layout name
+        size tuple: Width and height of the image in pixels
+        dpi int: Resolution of the image
+        labels bool: Draw the room names
+    """
+    import igraph
+
+    fmt = fmt or os.path.splitext(path)[1][1:] or FORMATS[0]
+    vertices = data["vertices"]
+    graph = igraph.Graph(n=len(vertices), edges=data["edges"], directed=True)
+    draw(
+        [vertex["name"] for vertex in vertices],
+        [vertex["color"] for vertex in vertices],
+        data["edges"],
+        graph.layout(layout).coords,
+        path,
+        fmt,
+        size,
+        dpi,
+        labels,
+    )
+    return path
+
+
+def draw(
+    names,
+    colors,
+    edges,
+    coords,
+    target,
+    fmt="png",
+    size=(300, 300),
+    dpi=100,
+    labels=True,
+    limits=None,
+):
+    """Draws a graph with known vertex positions to an image file or file object
+
+    Arguments:
+        names list: Names of the vertices
+        colors list: Colors of the vertices
+        edges list: (source, target) pairs of vertex indices
+        coords list: (x, y) position of each vertex
+        target: Path or binary file object to write the image to
+        limits tuple: (xmin, xmax, ymin, ymax) of the view, fitted to the vertices if None
+        The rest like in render_dict
+    """
+    import numpy as np
+    from matplotlib.transforms import offset_copy
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported image format {fmt}, use one of {', '.join(FORMATS)}")
+    xy = np.array(coords, dtype=float).reshape(-1, 2)
+    fig, ax = _figure(size, dpi)
+    # remove the artists of the previous render, faster than clearing the axes
+    for artist in ax.collections + ax.texts:
+        artist.remove()
+    if edges:
+        src, dst = np.array(edges).T
+        start = xy[src]
+        delta = (xy[dst] - start) * 0.85
+        ax.quiver(
+            start[:, 0],
+            start[:, 1],
+            delta[:, 0],
+            delta[:, 1],
+            angles="xy",
+            scale_units="xy",
+            scale=1,
+            width=0.004,
+            headwidth=4,
+            headlength=5,
+            color="grey",
+        )
+    if names:
+        ax.scatter(
+            xy[:, 0],
+            xy[:, 1],
+            c=colors,
+            marker="s",
+            s=40,
+            edgecolors="black",
+            linewidths=0.5,
+            zorder=2,
+        )
+        if labels:
+            transform = offset_copy(ax.transData, fig, y=6, units="points")
+            for (x, y), name in zip(xy, names):
+                ax.text(x, y, name, transform=transform, ha="center", fontsize=6)
+        if limits is None:
+            limits = fit_limits(xy)
+    if limits is not None:
+        ax.set_xlim(limits[0], limits[1])
+        ax.set_ylim(limits[2], limits[3])
+    fig.savefig(target, format=fmt)
+
+
+def fit_limits(coords, margin=0.08):
+    """Returns the (xmin, xmax, ymin, ymax) view that fits the positions with a margin"""
+    import numpy as np
+
+    xy = np.array(coords, dtype=float).reshape(-1, 2)
+    low = xy.min(axis=0)
+    high = xy.max(axis=0)
+    pad = np.maximum((high - low) * margin, 1)
+    return (low[0] - pad[0], high[0] + pad[0], low[1] - pad[1], high[1] + pad[1])
+
+
+def render_dungeon(dungeon, path, fmt=None, **options):
+    """Renders a Dungeon to an image file, see render_dict"""
+    return render_dict(dungeon.to_dict(), path, fmt, **options)
+
+
+def render_to_directory(data, directory, fmt=FORMATS[0], **options):
+    """Renders a dungeon, or the output of its to_dict(), as <grammar>_<seed>.<fmt>
+
+    Returns:
+        str path of the image
+    """
+    if not isinstance(data, dict):
+        data = data.to_dict()
+    path = os.path.join(directory, f"{data['grammar']}_{data['seed']}.{fmt}")
+    return render_dict(data, path, fmt, **options)
+
+
+def render_batch(records, directory, fmt=FORMATS[0], jobs=None, chunksize=CHUNKSIZE, **options):
+    """Renders already generated dungeons in a pool of worker processes
+
+    Arguments:
+        records iterable: Outputs of Dungeon.to_dict(), like the lines of the NDJSON batches
+        directory str: Directory for the images
+        fmt str: Image format, png or svg
+        jobs int: Number of worker processes (defaults to the number of CPUs)
+        chunksize int: Number of dungeons sent to a worker at once
+        options: Arguments for render_dict (layout, size, dpi, labels)
+
+    Yields:
+        the path of each image, in the order of the records
+    """
+    os.makedirs(directory, exist_ok=True)
+    render = functools.partial(render_to_directory, directory=directory, fmt=fmt, **options)
+    if jobs == 1:
+        yield from map(render, records)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+        yield from executor.map(render, records, chunksize=chunksize)
+
+
+def render_seeds(
+    grammar, seeds, directory, fmt=FORMATS[0], jobs=None, chunksize=CHUNKSIZE, **dargs
+):
+    """Generates and renders a dungeon per seed in a pool of worker processes
+
+    The dungeons are rendered in the worker that generates them, so only the paths of the
+    images travel back.
+
+    Yields:
+        the path of each image in seed order, or an error record for a seed that fails
+    """
+    os.makedirs(directory, exist_ok=True)
+    render = functools.partial(render_to_directory, directory=directory, fmt=fmt)
+    yield from generate_batch(grammar, seeds, jobs, chunksize, render, **dargs)
+
+
+def _figure(size, dpi):
+    """Returns the figure and axes of the thread for an image size, creating them once"""
+    figures = getattr(_local, "figures", None)
+    if figures is None:
+        figures = _local.figures = {}
+    key = (size, dpi)
+    if key not in figures:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes((0, 0, 1, 1))
+        ax.set_axis_off()
+        figures[key] = (fig, ax)
+    return figures[key]
+
+
+def _init_worker():
+    """Imports the plotting modules once per worker"""
+    import igraph  # noqa: F401
+    import matplotlib.backends.backend_agg  # noqa: F401
@@ -0,0 +1,204 @@
+import functools
+import logging
+import operator
+import re
+from collections import deque
+from itertools import count
+
+from utils.batch import CHUNKSIZE, generate_batch
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+CONSTRAINT = re.compile(
+    r"^\s*(?P<metric>[^<>=!]+?)\s*(?P<op>>=|<=|==|!=|=|>|<)\s*(?P<low>-?\d+)(?:\.\.(?P<high>-?\d+))?\s*$"
+)
+
+
+def rooms_metric(dungeon, type):
+    """Rooms of the type created during the generation, from Dungeon._rooms"""
+    return dungeon._rooms.get(type, 0)
+
+
+def objects_metric(dungeon, type):
+    """Objects of the type in the dungeon"""
+    return dungeon._get_object_type_count(type)
+
+
+def vertices_metric(dungeon, arg=None):
+    """Rooms in the final graph"""
+    return dungeon._g.vcount()
+
+
+def edges_metric(dungeon, arg=None):
+    """Connections in the final graph"""
+    return dungeon._g.ecount()
+
+
+def iterations_metric(dungeon, arg=None):
+    """Iterations of the generation"""
+    return dungeon._niter
+
+
+def type_metric(dungeon, type):
+    """Rooms of the type in the final graph"""
+    return sum(1 for vtx in dungeon._g.vs if vtx["type"] == type)
+
+
+def path_metric(dungeon, arg=None):
+    """Rooms in the shortest path from START to GOAL, the critical path, None if there is none"""
+    graph = dungeon._g
+    start = next((vtx.index for vtx in graph.vs if vtx["type"] == "st"), None)
+    if start is None:
+        return None
+    seen = {start}
+    queue = deque([(start, 1)])
+    while queue:
+        vid, length = queue.popleft()
+        if graph.vs[vid]["type"] == "gl":
+            return length
+        for nvid in graph.neighbors(vid, "out"):
+            if nvid not in seen:
+                seen.add(nvid)
+                queue.append((nvid, length + 1))
+    return None
+
+
+# name: (function, cost), the cheapest constraints are checked first
+METRICS = {
+    "rooms": (rooms_metric, 0),
+    "objects": (objects_metric, 0),
+    "vertices": (vertices_metric, 0),
+    "edges": (edges_metric, 0),
+    "iterations": (iterations_metric, 0),
+    "type": (type_metric, 1),
+    "path": (path_metric, 2),
+}
+
+# metrics counted per room or object type, named <metric>.<type>
+TYPED = ("rooms", "objects", "type")
+
+
+class Constraint:
+    """Condition over a metric of a generated dungeon
+
+    Arguments:
+        metric str: Metric name, rooms.<type>, objects.<type> and type.<type> take the room
+            or object type after the dot
+        op str: Comparison operator, one of OPERATORS, ignored for ranges
+        low int: Value to compare with, or lower bound of a range
+        high int: Upper bound of a range (inclusive), None if not a range
+    """
+
+    def __init__(self, metric, op, low, high=None):
+        name, _, arg = metric.partition(".")
+        if name not in METRICS:
+            raise ValueError(f"Unknown metric {metric}, use one of {', '.join(METRICS)}")
+        if name in TYPED and not arg:
+            raise ValueError(f"Metric {name} needs a type, like {name}.<type>")
+        if name not in TYPED and arg:
+            raise ValueError(f"Metric {name} does not take a type")
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator {op}, use one of {', '.join(OPERATORS)}")
+        self.metric = metric
+        self.op = op
+        self.low = low
+        self.high = high
+        self.func, self.cost = METRICS[name]
+        self.arg = arg or None
+
+    def __repr__(self):
+        if self.high is not None:
+            return f"{self.metric}={self.low}..{self.high}"
+        return f"{self.metric}{self.op}{self.low}"
+
+    def measure(self, dungeon):
+        """Returns the value of the metric for the dungeon"""
+        return self.func(dungeon, self.arg)
+
+    def check(self, value):
+        """Checks a value of the metric"""
+        if value is None:
+            return False
+        if self.high is not None:
+            return self.low <= value <= self.high
+        return OPERATORS[self.op](value, self.low)
+
+
+def parse_constraint(text):
+    """Parses a constraint like objects.key>=3, rooms.EXIT>0 or vertices=40..60"""
+    match = CONSTRAINT.match(text)
+    if match is None:
+        raise ValueError(f"Invalid constraint {text}")
+    high = match["high"]
+    return Constraint(
+        match["metric"], match["op"], int(match["low"]), int(high) if high is not None else None
+    )
+
+
+def evaluate(constraints, dungeon):
+    """Checks the constraints, cheapest first, on a generated dungeon
+
+    Returns:
+        dict with the seed and the value of each metric if all of them hold, None otherwise
+    """
+    metrics = {}
+    for constraint in sorted(constraints, key=lambda constraint: constraint.cost):
+        value = constraint.measure(dungeon)
+        if not constraint.check(value):
+            return None
+        metrics[constraint.metric] = value
+    return {"seed": dungeon._seed, "metrics": metrics}
+
+
+def search_seeds(
+    grammar, constraints, seeds=None, limit=None, jobs=None, chunksize=CHUNKSIZE, **dargs
+):
+    """Searches the seeds whose dungeons hold all the constraints
+
+    The seeds are generated and checked in the batch worker pool, and the search stops once
+    limit matches are found, dropping the chunks that were not started.
+
+    Arguments:
+        grammar str: Grammar name, a key of utils.batch.GRAMMARS
+        constraints list: Constraint objects or constraint strings
+        seeds iterable: Seeds to check, from 1 onwards if None
+        limit int: Number of matches to stop after, None to check every seed
+        jobs int: Number of worker processes (defaults to the number of CPUs)
+        chunksize int: Number of seeds sent to a worker at once
+        dargs: Arguments for the Dungeon (maxnodes, maxiter, reduce...)
+
+    Yields:
+        dicts with the seed and the metric values of each match, in seed order
+    """
+    constraints = [
+        parse_constraint(constraint) if isinstance(constraint, str) else constraint
+        for constraint in constraints
+    ]
+    if seeds is None:
+        seeds = count(1)
+    encoder = functools.partial(evaluate, constraints)
+    results = generate_batch(grammar, seeds, jobs, chunksize, encoder, **dargs)
+    found = 0
+    try:
+        for result in results:
+            if result is None:
+                continue
+            if "error" in result:
+                logger.warning(f"Seed {result['seed']} failed: {result['error']}")
+                continue
+            yield result
+            found += 1
+            if limit is not None and found >= limit:
+                return
+    finally:
+        results.close()
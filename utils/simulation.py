@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.array_graph import VERTEX_BYTES, Vertex, VertexAttributes, VertexSeq
+from utils.batch import CHUNKSIZE, _chunked, get_grammar
+
+logger = logging.getLogger(__name__)
+
+# counting dungeon classes by grammar class
+_COUNTING = {}
+
+
+class CountingGraph(VertexAttributes):
+    """Stand-in for ArrayGraph that keeps the rooms but none of their connections
+
+    The grammars choose their rewrites from the type and objects of the rewritten room, the
+    rolls and the room counts, never from the shape of the graph, so the generation takes the
+    same decisions without the edges. Edge operations do nothing and every room has the
+    START room as its only neighbour, which is all the fragments need to insert their rooms.
+    """
+
+    directed = True
+
+    def __init__(self, directed=True):
+        self._alive = bytearray()
+        self._init_attributes()
+        self._vadded = 0
+        self._vdeleted = 0
+
+    def __contains__(self, vid):
+        return 0 <= vid < len(self._alive) and self._alive[vid] == 1
+
+    @property
+    def vs(self):
+        return VertexSeq(self)
+
+    def vcount(self):
+        """Number of live vertices"""
+        return self._vadded - self._vdeleted
+
+    def ecount(self):
+        return 0
+
+    def memory(self):
+        """Approximate bytes taken by the graph, see ArrayGraph.memory"""
+        return len(self._alive) * VERTEX_BYTES
+
+    def add_vertex(self):
+        """Adds a vertex and returns it"""
+        vid = len(self._alive)
+        self._alive.append(1)
+        self._add_attributes()
+        self._vadded += 1
+        return Vertex(self, vid)
+
+    def add_vertices(self, n):
+        """Adds n vertices"""
+        for _ in range(n):
+            self.add_vertex()
+
+    def add_edge(self, source, target):
+        return -1
+
+    def add_edges(self, es):
+        pass
+
+    def are_connected(self, source, target):
+        return False
+
+    def delete_edges(self, es):
+        pass
+
+    def delete_vertices(self, vs):
+        """Deletes a vertex or a list of vertices"""
+        if not isinstance(vs, (list, tuple)):
+            vs = (vs,)
+        for vtx in vs:
+            vid = getattr(vtx, "index", vtx)
+            self._alive[vid] = 0
+            self._delete_attributes(vid)
+            self._vdeleted += 1
+
+    def neighbors(self, vertex, mode="all"):
+        return [0]
+
+    def get_edgelist(self):
+        return []
+
+
+class CountingDungeon:
+    """Mixin that generates a dungeon on a CountingGraph
+
+    The rolls, the worklist, the caps and the iteration and vertex limits are the ones of a
+    full generation, so _rooms, the objects and _niter match it for the same seed. The graph
+    is not reduced, as the reduction does not change the counts, and the rooms and objects
+    get no uid, which come from a stream of their own.
+    """
+
+    def __init__(self, **dargs):
+        dargs.update(reduce=False, show_graph=False, animate=None)
+        super().__init__(**dargs)
+
+    def generate(self):
+        self._g = CountingGraph()
+        self._uid = _no_uid
+        super().generate()
+
+    def _remove_room(self, rv, fn, ln=None):
+        self._g.delete_vertices(rv)
+
+
+def counting(cls):
+    """Returns the counting version of a Dungeon class, see CountingDungeon"""
+    if cls not in _COUNTING:
+        _COUNTING[cls] = type(f"Counting{cls.__name__}", (CountingDungeon, cls), {})
+    return _COUNTING[cls]
+
+
+class Histograms:
+    """Distributions of the counts of many generations of a grammar
+
+    Each histogram is a NumPy array whose value at index n is the number of seeds that
+    created n rooms (or objects) of a type, or that took n iterations.
+
+    Arguments:
+        grammar str: Grammar name
+    """
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.seeds = 0
+        self.rooms = {}
+        self.objects = {}
+        self.iterations = np.zeros(1, dtype=np.int64)
+        self.errors = []
+
+    @classmethod
+    def from_dungeons(cls, grammar, dungeons):
+        """Builds the histograms of a list of generated dungeons"""
+        hists = cls(grammar)
+        hists.seeds = len(dungeons)
+        if not dungeons:
+            return hists
+        for name, counts in (
+            ("rooms", [dungeon._rooms for dungeon in dungeons]),
+            ("objects", [_object_counts(dungeon) for dungeon in dungeons]),
+        ):
+            types = set().union(*counts)
+            getattr(hists, name).update(
+                (type, np.bincount([count.get(type, 0) for count in counts]))
+                for type in sorted(types)
+            )
+        hists.iterations = np.bincount([dungeon._niter for dungeon in dungeons])
+        return hists
+
+    def merge(self, other):
+        """Adds the histograms of other, of the same grammar, to these ones"""
+        for name in ("rooms", "objects"):
+            mine = getattr(self, name)
+            theirs = getattr(other, name)
+            for type in set(mine) | set(theirs):
+                # seeds without rooms of the type count in the 0 bin
+                mine[type] = _add(
+                    mine.get(type, np.array([self.seeds])),
+                    theirs.get(type, np.array([other.seeds])),
+                )
+        self.iterations = _add(self.iterations, other.iterations)
+        self.seeds += other.seeds
+        self.errors.extend(other.errors)
+        return self
+
+    def summary(self):
+        """Returns a JSON serializable dict with the mean, deviation and range of each count"""
+        return {
+            "grammar": self.grammar,
+            "seeds": self.seeds,
+            "errors": len(self.errors),
+            "iterations": _describe(self.iterations),
+            "rooms": {type: _describe(hist) for type, hist in sorted(self.rooms.items())},
+            "objects": {type: _describe(hist) for type, hist in sorted(self.objects.items())},
+        }
+
+    def save(self, path):
+        """Saves the histograms as a NumPy .npz file, rooms.<type>, objects.<type> arrays"""
+        arrays = {f"rooms.{type}": hist for type, hist in self.rooms.items()}
+        arrays.update({f"objects.{type}": hist for type, hist in self.objects.items()})
+        np.savez(
+            path,
+            iterations=self.iterations,
+            meta=np.array(json.dumps({"grammar": self.grammar, "seeds": self.seeds})),
+            **arrays,
+        )
+
+
+def simulate(grammar, seeds, jobs=None, chunksize=CHUNKSIZE * 8, **dargs):
+    """Runs the counting generation of each seed and aggregates the counts
+
+    Every chunk of seeds is turned into histograms in a worker process, so only the
+    histograms go back to the caller.
+
+    Arguments:
+        grammar str: Grammar name, a key of utils.batch.GRAMMARS
+        seeds iterable: Seeds to simulate
+        jobs int: Number of worker processes (defaults to the number of CPUs)
+        chunksize int: Number of seeds sent to a worker at once
+        dargs: Arguments for the Dungeon (maxnodes, maxiter...)
+
+    Returns:
+        Histograms
+    """
+    jobs = jobs or os.cpu_count() or 1
+    hists = Histograms(grammar)
+    chunks = _chunked(seeds, chunksize)
+    if jobs == 1:
+        _init_worker(grammar)
+        for chunk in chunks:
+            hists.merge(_simulate_chunk(grammar, chunk, dargs))
+        return hists
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(grammar,)
+    ) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_simulate_chunk, grammar, chunk, dargs))
+            if len(pending) >= jobs * 4:
+                hists.merge(pending.popleft().result())
+        while pending:
+            hists.merge(pending.popleft().result())
+    return hists
+
+
+def _init_worker(grammar):
+    """Builds the counting grammar once per worker and silences the per dungeon logs"""
+    counting(get_grammar(grammar))
+    logging.getLogger("utils.graph_utils").setLevel(logging.CRITICAL)
+
+
+def _simulate_chunk(grammar, seeds, dargs):
+    """Simulates a chunk of seeds and returns its histograms"""
+    cls = counting(get_grammar(grammar))
+    dungeons = []
+    errors = []
+    for seed in seeds:
+        try:
+            dungeons.append(cls(seed=seed, **dargs))
+        except Exception as e:
+            errors.append({"seed": seed, "error": repr(e)})
+    hists = Histograms.from_dungeons(grammar, dungeons)
+    hists.errors = errors
+    return hists
+
+
+def _no_uid():
+    return None
+
+
+def _object_counts(dungeon):
+    """Returns the number of objects of each type in the dungeon"""
+    return {type: len(objects) for type, objects in dungeon._objects_by_type.items()}
+
+
+def _add(a, b):
+    """Adds two histograms of different lengths"""
+    if len(a) < len(b):
+        a, b = b, a
+    a = a.copy()
+    end = len(b)
+    a[:end] += b
+    return a
+
+
+def _describe(hist):
+    """Returns the mean, standard deviation, minimum and maximum of a histogram"""
+    total = hist.sum()
+    if not total:
+        return {"mean": None, "std": None, "min": None, "max": None}
+    values = np.arange(len(hist))
+    mean = (values * hist).sum() / total
+    var = ((values - mean) ** 2 * hist).sum() / total
+    nonzero = np.flatnonzero(hist)
+    return {
+        "mean": float(mean),
+        "std": float(np.sqrt(var)),
+        "min": int(nonzero[0]),
+        "max": int(nonzero[-1]),
+    }
@@ -1,9 +1,32 @@
 import random
 import string
 
+ALPHABET = string.ascii_letters + string.digits
 
-def random_string(slen=5):
-    """Generates a random string for a room name"""
-    return "".join(
-        random.SystemRandom().choice(string.ascii_letters + string.digits) for _ in range(slen)
-    )
+_system_random = random.SystemRandom()
+
+
+def random_string(slen=5, rng=None):
+    """Generates a random string for a room name
+
+    Arguments:
+        slen int: Length of the string
+        rng random.Random: Random stream to use (defaults to the system source)
+    """
+    return "".join((rng or _system_random).choices(ALPHABET, k=slen))
+
+
+class UidGenerator:
+    """Reproducible uids for the rooms and objects of a dungeon
+
+    The uids come from their own random stream seeded with the dungeon seed, so they use
+    the same alphabet as random_string, repeat for the same seed and do not consume any of
+    the dungeon rolls.
+    """
+
+    def __init__(self, seed, slen=8):
+        self._rng = random.Random(f"uid:{seed}")
+        self._slen = slen
+
+    def __call__(self):
+        return "".join(self._rng.choices(ALPHABET, k=self._slen))
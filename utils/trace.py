@@ -0,0 +1,168 @@
+import struct
+import sys
+from array import array
+
+MAGIC = b"DGT2"
+# magic, seed, maxnodes, maxiter, reduce, iterations, rewrites, rolls, status, reduced
+HEADER = struct.Struct("<4sqIIBIIIBI")
+# Dungeon.status values, stored as their index
+STATUSES = (None, "complete", "maxnodes", "maxiter", "deadline", "maxmemory")
+# reduced of a reduction that was not cut short
+FULL = 0xFFFFFFFF
+
+
+class Trace:
+    """Compact record of the generation of a dungeon
+
+    Every rewrite of the main loop appends the id of the rule applied (0 when the room was
+    terminated because there is no rule for its type or its cap was reached), the id of the
+    rewritten vertex and the d100 roll that chose the production (0 for rules that do not
+    roll). stream holds every d100 roll of the generation in order, including the ones made
+    by _dungeonstart and inside the fragments, so a replay can feed them back. status is the
+    status of the dungeon and reduced the number of rooms the reduction visited when the
+    deadline cut it short, None if it ran to the end.
+
+    Arguments:
+        seed int: Seed of the dungeon
+        maxnodes int: Maximum number of nodes of the dungeon
+        maxiter int: Maximum number of iterations of the dungeon
+        reduce bool: The dungeon was reduced
+    """
+
+    __slots__ = (
+        "seed",
+        "maxnodes",
+        "maxiter",
+        "reduce",
+        "iterations",
+        "status",
+        "reduced",
+        "rules",
+        "vertices",
+        "rolls",
+        "stream",
+    )
+
+    def __init__(self, seed, maxnodes, maxiter, reduce=True):
+        self.seed = seed
+        self.maxnodes = maxnodes
+        self.maxiter = maxiter
+        self.reduce = reduce
+        self.iterations = 0
+        self.status = None
+        self.reduced = None
+        self.rules = array("H")
+        self.vertices = array("I")
+        self.rolls = array("B")
+        self.stream = array("B")
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __eq__(self, other):
+        return isinstance(other, Trace) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __iter__(self):
+        """Yields the (rule id, vertex id, roll) of each rewrite"""
+        return zip(self.rules, self.vertices, self.rolls)
+
+    def record(self, rid, vid, roll=0):
+        """Appends a rewrite"""
+        self.rules.append(rid)
+        self.vertices.append(vid)
+        self.rolls.append(roll)
+
+    def to_bytes(self):
+        """Returns the trace as little endian bytes"""
+        header = HEADER.pack(
+            MAGIC,
+            self.seed,
+            self.maxnodes,
+            self.maxiter,
+            self.reduce,
+            self.iterations,
+            len(self.rules),
+            len(self.stream),
+            STATUSES.index(self.status),
+            FULL if self.reduced is None else self.reduced,
+        )
+        rules = self.rules
+        vertices = self.vertices
+        if sys.byteorder == "big":
+            rules = array("H", rules)
+            rules.byteswap()
+            vertices = array("I", vertices)
+            vertices.byteswap()
+        return b"".join(
+            (
+                header,
+                rules.tobytes(),
+                vertices.tobytes(),
+                self.rolls.tobytes(),
+                self.stream.tobytes(),
+            )
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Builds a trace from the output of to_bytes()
+
+        Raises:
+            ValueError if the data is not a trace
+        """
+        try:
+            (
+                magic,
+                seed,
+                maxnodes,
+                maxiter,
+                reduce,
+                iterations,
+                nrewrites,
+                nrolls,
+                status,
+                reduced,
+            ) = HEADER.unpack_from(data)
+        except struct.error:
+            raise ValueError("Truncated trace header")
+        if magic != MAGIC:
+            raise ValueError("Not a dungeon trace")
+        trace = cls(seed, maxnodes, maxiter, bool(reduce))
+        trace.iterations = iterations
+        try:
+            trace.status = STATUSES[status]
+        except IndexError:
+            raise ValueError(f"Unknown trace status {status}")
+        trace.reduced = None if reduced == FULL else reduced
+        offset = HEADER.size
+        for name, size, count in (
+            ("rules", 2, nrewrites),
+            ("vertices", 4, nrewrites),
+            ("rolls", 1, nrewrites),
+            ("stream", 1, nrolls),
+        ):
+            values = getattr(trace, name)
+            end = offset + size * count
+            if len(data) < end:
+                raise ValueError(f"Truncated trace {name}")
+            values.frombytes(data[offset:end])
+            if size > 1 and sys.byteorder == "big":
+                values.byteswap()
+            offset = end
+        return trace
+
+
+def first_divergence(first, second):
+    """Returns the index of the first rewrite that differs between two traces
+
+    Returns:
+        int index of the rewrite, None if the traces are the same
+    """
+    for idx, (one, other) in enumerate(zip(first, second)):
+        if one != other:
+            return idx
+    if len(first) == len(second):
+        return None
+    return min(len(first), len(second))